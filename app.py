@@ -1,7 +1,7 @@
 from flask import Flask, jsonify, request, render_template, session, redirect, url_for
 import requests
 import datetime
-from functools import wraps # V5.0
+from functools import wraps, reduce # V5.0
 import pandas as pd
 import numpy as np
 import os
@@ -9,6 +9,15 @@ import uuid
 import json
 import time
 import random
+import threading
+import multiprocessing
+import urllib.parse
+import hashlib
+import copy
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict
+from dateutil import tz as dateutil_tz
 
 # V5.0: 增强的环境配置
 DATABASE_URL = os.environ.get('DATABASE_URL')
@@ -109,68 +118,122 @@ def db_execute(cursor, query, params=None):
     else:
         return cursor.execute(query)
 
+ANNOTATION_INSERT_BATCH = 100  # 每条多行INSERT语句写入的注释数（SQLite单条语句的参数个数有上限）
+
 def save_algorithm_annotation(ticker, date, text, algorithm_type, algorithm_params=None):
     """保存算法生成的注释到数据库"""
+    return save_algorithm_annotations(ticker, [(date, text, algorithm_type, algorithm_params)])[0]
+
+def save_algorithm_annotations(ticker, rows):
+    """
+    V8.4: 批量保存算法生成的注释（一个连接、一个事务）
+    rows: [(日期, 注释文字, 算法类型, 算法参数)]
+    规则与逐条保存一致：同日已有未删除的AI分析记录时返回AI分析记录；已有同一算法类型的记录时，
+    未删除则复用、已删除则跳过（返回None）；否则新建。
+    已有记录用一次查询取出，新记录用多行 INSERT ... ON CONFLICT DO NOTHING 写入，
+    并发请求抢先写入的记录（唯一索引冲突）再查询一次取回
+    返回：与rows一一对应的注释信息列表
+    """
+    if not rows:
+        return []
+
+    def existing_result(row, annotation_type=None):
+        result = {'id': row['annotation_id'], 'text': row['text'], 'exists': True,
+                  'is_favorite': bool(row['is_favorite']) if row['is_favorite'] is not None else False}
+        if annotation_type:
+            result['type'] = annotation_type
+        return result
+
     try:
         db = get_db()
         cursor = db.cursor()
-        
-        # 生成唯一的注释ID
-        annotation_id = f"algo-{ticker}-{date}-{algorithm_type}-{uuid.uuid4().hex[:8]}"
-        
-        # V4.8.1: 增强重复检查逻辑 - 优先检查是否已存在AI分析记录
-        db_execute(cursor, """
-            SELECT annotation_id, text, algorithm_type, is_deleted, is_favorite FROM annotations
-            WHERE ticker = %s AND date = %s AND algorithm_type = 'ai_analysis' AND is_deleted = 0
-        """, (ticker, date))
-        
-        ai_existing = cursor.fetchone()
-        if ai_existing:
-            # 如果已存在AI分析记录，不生成新的算法记录（AI分析优先级更高）
-            print(f"[INFO] 跳过算法记录生成 {ticker}-{date}-{algorithm_type}：已存在AI分析记录 {ai_existing['annotation_id']}")
-            cursor.close()
-            db.close()
-            return {'id': ai_existing['annotation_id'], 'text': ai_existing['text'], 'exists': True, 'type': 'ai_analysis', 'is_favorite': bool(ai_existing['is_favorite']) if ai_existing['is_favorite'] is not None else False}
-        
-        # 检查是否已存在相同的算法注释（同一股票、同一日期、同一算法类型）
+
+        # 该股票已有的算法/AI分析记录，同一键只保留最早的一条（与逐条查询时fetchone的结果一致）
         db_execute(cursor, """
-            SELECT annotation_id, text, is_deleted, is_favorite FROM annotations
-            WHERE ticker = %s AND date = %s AND algorithm_type = %s
-        """, (ticker, date, algorithm_type))
-        
-        existing = cursor.fetchone()
-        if existing:
-            if existing['is_deleted'] == 0:
-                # 如果存在未删除的注释，返回现有注释的ID和内容
-                print(f"[INFO] 复用现有算法记录: {existing['annotation_id']}")
-                cursor.close()
-                db.close()
-                return {'id': existing['annotation_id'], 'text': existing['text'], 'exists': True, 'is_favorite': bool(existing['is_favorite']) if existing['is_favorite'] is not None else False}
+            SELECT annotation_id, date, text, algorithm_type, is_deleted, is_favorite FROM annotations
+            WHERE ticker = %s AND algorithm_type IS NOT NULL
+            ORDER BY id
+        """, (ticker,))
+        ai_rows = {}
+        algorithm_rows = {}
+        for row in cursor.fetchall():
+            if row['algorithm_type'] == 'ai_analysis' and row['is_deleted'] == 0:
+                ai_rows.setdefault(row['date'], row)
+            algorithm_rows.setdefault((row['date'], row['algorithm_type']), row)
+
+        results = [None] * len(rows)
+        pending = {}  # (日期, 算法类型) -> 待新建的注释，同一批内重复的键只新建一次
+        reused = skipped = 0
+        for i, (date, text, algorithm_type, algorithm_params) in enumerate(rows):
+            key = (date, algorithm_type)
+            if date in ai_rows:
+                # 如果已存在AI分析记录，不生成新的算法记录（AI分析优先级更高）
+                results[i] = existing_result(ai_rows[date], 'ai_analysis')
+                reused += 1
+            elif key in algorithm_rows:
+                # 未删除的记录直接复用，已删除的记录保持删除状态
+                if algorithm_rows[key]['is_deleted'] == 0:
+                    results[i] = existing_result(algorithm_rows[key])
+                    reused += 1
+                else:
+                    skipped += 1
+            elif key not in pending:
+                pending[key] = {
+                    'annotation_id': f"algo-{ticker}-{date}-{algorithm_type}-{uuid.uuid4().hex[:8]}",
+                    'text': text,
+                    'params_json': json.dumps(algorithm_params) if algorithm_params else None,
+                    'indices': [i]
+                }
             else:
-                # 如果存在已删除的注释，不创建新注释（保持删除状态）
-                print(f"[INFO] 跳过已删除的记录: {ticker}-{date}-{algorithm_type}")
-                cursor.close()
-                db.close()
-                return None
-        
-        # 保存新的算法注释
-        params_json = json.dumps(algorithm_params) if algorithm_params else None
-        db_execute(cursor, """
-            INSERT INTO annotations
-            (annotation_id, ticker, date, text, annotation_type, algorithm_type, algorithm_params, created_at, updated_at)
-            VALUES (%s, %s, %s, %s, 'algorithm', %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-        """, (annotation_id, ticker, date, text, algorithm_type, params_json))
-        
+                pending[key]['indices'].append(i)
+
+        inserted_ids = set()
+        items = list(pending.items())
+        for start in range(0, len(items), ANNOTATION_INSERT_BATCH):
+            batch = items[start:start + ANNOTATION_INSERT_BATCH]
+            values = []
+            for (date, algorithm_type), item in batch:
+                values.extend([item['annotation_id'], ticker, date, item['text'], algorithm_type, item['params_json']])
+            placeholders = ', '.join(["(%s, %s, %s, %s, 'algorithm', %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)"] * len(batch))
+            db_execute(cursor, f"""
+                INSERT INTO annotations
+                (annotation_id, ticker, date, text, annotation_type, algorithm_type, algorithm_params, created_at, updated_at)
+                VALUES {placeholders}
+                ON CONFLICT DO NOTHING
+                RETURNING annotation_id
+            """, values)
+            inserted_ids.update(row['annotation_id'] for row in cursor.fetchall())
+
+        conflicted = [key for key, item in pending.items() if item['annotation_id'] not in inserted_ids]
+        if conflicted:
+            # 其他请求在查询之后抢先写入了相同的键，按同样的规则取回其记录
+            db_execute(cursor, f"""
+                SELECT annotation_id, date, text, algorithm_type, is_deleted, is_favorite FROM annotations
+                WHERE ticker = %s AND date IN ({', '.join(['%s'] * len(conflicted))})
+                ORDER BY id
+            """, [ticker] + [date for date, _ in conflicted])
+            current = {}
+            for row in cursor.fetchall():
+                current.setdefault((row['date'], row['algorithm_type']), row)
+            for key in conflicted:
+                row = current.get(key)
+                pending[key]['result'] = existing_result(row) if row is not None and row['is_deleted'] == 0 else None
+
         db.commit()
         cursor.close()
         db.close()
-        
-        print(f"[INFO] 新建算法记录: {annotation_id} - {text}")
-        return {'id': annotation_id, 'text': text, 'exists': False, 'is_favorite': False}
-        
+
+        for key, item in pending.items():
+            result = item.get('result', {'id': item['annotation_id'], 'text': item['text'], 'exists': False, 'is_favorite': False})
+            for n, i in enumerate(item['indices']):
+                # 同一批内重复的键：第一条为新建，其余与逐条保存时一样视为复用
+                results[i] = dict(result, exists=result['exists'] or n > 0) if result is not None else None
+        print(f"[INFO] 算法注释 {ticker}: 新建 {len(inserted_ids)} 条，复用 {reused} 条，跳过已删除 {skipped} 条")
+        return results
+
     except Exception as e:
         print(f"[ERROR] 保存算法注释失败: {e}")
-        return None
+        return [None] * len(rows)
 
 def init_db():
     with app.app_context():
@@ -345,8 +408,31 @@ def init_db():
             print(f"📊 初始化了 {len(local_mappings)} 个本地公司名称映射")
         else:
             print("📋 company_names表已存在")
-        
+
+        # V6.9: 各股票的访问次数，用于收盘后预取访问最多的股票
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ticker_request_stats (
+                ticker TEXT PRIMARY KEY,
+                request_count INTEGER NOT NULL DEFAULT 0,
+                last_requested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
         conn.commit()
+
+        # V8.4: 算法注释在(ticker, date, algorithm_type)上唯一，批量写入时以 ON CONFLICT DO NOTHING 去重
+        # （AI分析会把算法注释改为ai_analysis类型，同日可能有多条，不在约束范围内）
+        try:
+            cursor.execute('''
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_annotations_algorithm_key
+                ON annotations (ticker, date, algorithm_type)
+                WHERE annotation_type = 'algorithm' AND algorithm_type <> 'ai_analysis'
+            ''')
+            conn.commit()
+        except Exception as e:
+            # 历史数据中已有重复的算法注释时不创建索引，批量写入仍按查询结果去重
+            conn.rollback()
+            print(f"[WARNING] 未创建算法注释唯一索引（可能存在重复记录）: {e}")
+
         cursor.close()
         conn.close()
 
@@ -711,6 +797,300 @@ HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
 }
 
+# --- V6.2: 出站HTTP连接池 ---
+# 每个外部域名共用一个带连接池的Session，保持keep-alive，避免每次请求重新握手
+HTTP_POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', 4))
+HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 10))  # 单个域名的最大保持连接数
+
+# 各外部服务的默认超时（秒），调用方显式传入timeout时以调用方为准
+HTTP_HOST_TIMEOUTS = {
+    'query1.finance.yahoo.com': 10,
+    'hq.sinajs.cn': 15,
+    'www.alphavantage.co': 15,
+    'api.biyingapi.com': 30,
+    'work.pgi.chat': 600,
+}
+HTTP_DEFAULT_TIMEOUT = 30
+
+http_sessions = {}
+http_sessions_lock = threading.Lock()
+
+def get_http_session(host):
+    """获取指定域名的共享Session（线程安全，首次使用时创建）"""
+    with http_sessions_lock:
+        session = http_sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=HTTP_POOL_CONNECTIONS,
+                pool_maxsize=HTTP_POOL_MAXSIZE
+            )
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            http_sessions[host] = session
+            print(f"[HTTP] 创建连接池: {host} (pool_maxsize={HTTP_POOL_MAXSIZE})")
+        return session
+
+def http_request(method, url, **kwargs):
+    """所有出站HTTP请求的统一入口：按域名复用连接池并应用默认超时"""
+    host = urllib.parse.urlsplit(url).hostname or ''
+    kwargs.setdefault('timeout', HTTP_HOST_TIMEOUTS.get(host, HTTP_DEFAULT_TIMEOUT))
+    # V6.6: 回放模式下从本地fixture返回录制的响应，不访问真实API
+    if MARKET_DATA_PROVIDER == 'replay':
+        return replay_http_request(method, url, **kwargs)
+    response = get_http_session(host).request(method, url, **kwargs)
+    if MARKET_DATA_PROVIDER == 'record':
+        record_http_response(method, url, response, **kwargs)
+    return response
+
+def http_get(url, **kwargs):
+    return http_request('GET', url, **kwargs)
+
+def http_post(url, **kwargs):
+    return http_request('POST', url, **kwargs)
+
+def get_http_pool_stats():
+    """统计各域名连接池的新建连接数和复用次数"""
+    stats = {}
+    with http_sessions_lock:
+        sessions = dict(http_sessions)
+    for host, session in sessions.items():
+        opened = 0
+        total_requests = 0
+        seen_pools = set()
+        for adapter in session.adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None or id(pool) in seen_pools:
+                    continue
+                seen_pools.add(id(pool))
+                opened += pool.num_connections
+                total_requests += pool.num_requests
+        stats[host] = {
+            'requests': total_requests,
+            'connections_opened': opened,
+            'connections_reused': max(0, total_requests - opened),
+            'timeout': HTTP_HOST_TIMEOUTS.get(host, HTTP_DEFAULT_TIMEOUT)
+        }
+    return stats
+
+# --- V6.6: 离线回放数据源 ---
+# MARKET_DATA_PROVIDER=live（默认）直连外部API；record 在直连的同时把响应录制到fixture目录；
+# replay 只从fixture目录读取录制的响应（Yahoo K线、新浪hq_str_、Alpha Vantage、Dify工作流），
+# 可附加人为延迟和错误注入，用于可重复的压测和基准测试
+MARKET_DATA_PROVIDER = os.environ.get('MARKET_DATA_PROVIDER', 'live').lower()
+REPLAY_FIXTURE_DIR = os.environ.get('REPLAY_FIXTURE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'replay'))
+REPLAY_LATENCY_MS = float(os.environ.get('REPLAY_LATENCY_MS', 0))  # 每次回放附加的延迟（毫秒）
+REPLAY_ERROR_RATE = float(os.environ.get('REPLAY_ERROR_RATE', 0))  # 注入错误的概率（0~1）
+REPLAY_ERROR_STATUS = int(os.environ.get('REPLAY_ERROR_STATUS', 429))  # 注入错误的HTTP状态码，0表示模拟连接失败
+# 不参与fixture匹配的查询参数：随时间变化的时间范围和密钥（密钥也不会写入fixture）
+REPLAY_IGNORED_PARAMS = {'period1', 'period2', 'apikey', 'token'}
+
+if MARKET_DATA_PROVIDER != 'live':
+    print(f"[REPLAY] 数据源模式: {MARKET_DATA_PROVIDER}，fixture目录: {REPLAY_FIXTURE_DIR}")
+
+def replay_fixture_paths(method, url, **kwargs):
+    """
+    计算请求对应的fixture文件路径
+    返回：(精确匹配路径, 按接口路径的默认路径, 脱敏后的URL)
+    精确匹配按 方法+路径+查询参数+请求体 计算摘要；找不到时回退到同一接口路径的默认fixture
+    """
+    prepared = requests.Request(method, url, params=kwargs.get('params'),
+                                data=kwargs.get('data'), json=kwargs.get('json')).prepare()
+    parts = urllib.parse.urlsplit(prepared.url)
+    query = sorted((k, v) for k, v in urllib.parse.parse_qsl(parts.query) if k not in REPLAY_IGNORED_PARAMS)
+    body = prepared.body or b''
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+
+    digest = hashlib.sha1(f"{method.upper()} {parts.path}?{urllib.parse.urlencode(query)}".encode('utf-8') + b'\n' + body).hexdigest()[:16]
+    slug = parts.path.strip('/').replace('/', '_') or 'root'
+    host_dir = os.path.join(REPLAY_FIXTURE_DIR, parts.hostname or 'unknown')
+    safe_url = urllib.parse.urlunsplit((parts.scheme, parts.netloc, parts.path, urllib.parse.urlencode(query), ''))
+    return os.path.join(host_dir, f"{slug}__{digest}.json"), os.path.join(host_dir, f"{slug}.json"), safe_url
+
+def build_replay_response(url, status_code, body, encoding='utf-8', headers=None):
+    """构造与真实请求一致的requests.Response对象"""
+    response = requests.Response()
+    response.status_code = status_code
+    response.url = url
+    response.encoding = encoding
+    response._content = body.encode(encoding or 'utf-8')
+    response.headers.update(headers or {})
+    response.reason = 'REPLAY'
+    return response
+
+def replay_http_request(method, url, **kwargs):
+    """从fixture目录返回录制的响应，附加配置的延迟和错误注入"""
+    if REPLAY_LATENCY_MS > 0:
+        time.sleep(REPLAY_LATENCY_MS / 1000.0)
+
+    if REPLAY_ERROR_RATE > 0 and random.random() < REPLAY_ERROR_RATE:
+        print(f"[REPLAY] 注入错误({REPLAY_ERROR_STATUS}): {method} {url}")
+        if REPLAY_ERROR_STATUS == 0:
+            raise requests.exceptions.ConnectionError(f"回放模式注入的连接错误: {url}")
+        return build_replay_response(url, REPLAY_ERROR_STATUS, 'Too Many Requests' if REPLAY_ERROR_STATUS == 429 else 'Injected error')
+
+    exact_path, default_path, safe_url = replay_fixture_paths(method, url, **kwargs)
+    for path in (exact_path, default_path):
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                fixture = json.load(f)
+            print(f"[REPLAY] 回放: {method} {safe_url} <- {os.path.basename(path)}")
+            return build_replay_response(url, fixture.get('status', 200), fixture.get('body', ''),
+                                         fixture.get('encoding') or 'utf-8', fixture.get('headers'))
+
+    print(f"[REPLAY] 缺少fixture: {method} {safe_url} ({exact_path})")
+    raise requests.exceptions.ConnectionError(f"回放模式下没有找到fixture: {safe_url}")
+
+def record_http_response(method, url, response, **kwargs):
+    """录制模式：把真实响应写入fixture目录（同一接口路径的第一份录制同时作为默认fixture）"""
+    try:
+        exact_path, default_path, safe_url = replay_fixture_paths(method, url, **kwargs)
+        fixture = {
+            'request': {'method': method.upper(), 'url': safe_url},
+            'status': response.status_code,
+            'encoding': response.encoding,
+            'headers': {'Content-Type': response.headers.get('Content-Type', '')},
+            'body': response.text,
+            'recorded_at': datetime.datetime.now().isoformat()
+        }
+        os.makedirs(os.path.dirname(exact_path), exist_ok=True)
+        for path in (exact_path, default_path):
+            if path == exact_path or not os.path.exists(path):
+                with open(path, 'w', encoding='utf-8') as f:
+                    json.dump(fixture, f, ensure_ascii=False)
+        print(f"[REPLAY] 已录制: {method} {safe_url} -> {os.path.basename(exact_path)}")
+    except Exception as e:
+        print(f"[WARNING] 录制响应失败: {e}")
+
+# --- V6.3: 并发相同请求合并（single-flight） ---
+# 同一key的并发调用只执行一次，其余调用方等待并共享该次结果
+inflight_calls = {}
+inflight_lock = threading.Lock()
+
+def single_flight(key, fn, *args, **kwargs):
+    """执行fn(*args, **kwargs)；若相同key的调用正在进行，则等待其结果而不重复执行"""
+    with inflight_lock:
+        call = inflight_calls.get(key)
+        is_leader = call is None
+        if is_leader:
+            call = {'event': threading.Event(), 'result': None, 'error': None, 'waiters': 0}
+            inflight_calls[key] = call
+        else:
+            call['waiters'] += 1
+
+    if not is_leader:
+        print(f"[SINGLE_FLIGHT] 合并并发请求: {key}")
+        call['event'].wait()
+        if call['error'] is not None:
+            raise call['error']
+        return call['result']
+
+    try:
+        call['result'] = fn(*args, **kwargs)
+        return call['result']
+    except Exception as e:
+        call['error'] = e
+        raise
+    finally:
+        with inflight_lock:
+            inflight_calls.pop(key, None)
+        call['event'].set()
+
+# --- V6.4: Yahoo Finance出站限流（令牌桶 + 自适应退避） ---
+# 全进程共用一个令牌桶；遇到429或非JSON响应（限流页面）时按指数退避并加随机抖动，
+# 退避期间调用方排队等待，有缓存的请求直接使用缓存而不再请求Yahoo
+YAHOO_RATE_PER_SEC = float(os.environ.get('YAHOO_RATE_PER_SEC', 2))  # 令牌补充速率（次/秒）
+YAHOO_RATE_BURST = float(os.environ.get('YAHOO_RATE_BURST', 5))  # 令牌桶容量（允许的突发请求数）
+YAHOO_BACKOFF_BASE = float(os.environ.get('YAHOO_BACKOFF_BASE', 5))  # 首次退避时长（秒）
+YAHOO_BACKOFF_MAX = float(os.environ.get('YAHOO_BACKOFF_MAX', 300))  # 退避时长上限（秒）
+YAHOO_QUEUE_TIMEOUT = float(os.environ.get('YAHOO_QUEUE_TIMEOUT', 10))  # 无缓存时排队等待的最长时间（秒）
+
+yahoo_rate_state = {
+    'tokens': YAHOO_RATE_BURST,
+    'refilled_at': time.time(),
+    'backoff_until': 0.0,
+    'consecutive_throttles': 0,
+    'queued': 0,
+    'throttle_count': 0
+}
+yahoo_rate_lock = threading.Lock()
+
+def refill_yahoo_tokens(now):
+    """按经过的时间补充令牌（调用方需持有yahoo_rate_lock），退避期间不补充"""
+    start = max(yahoo_rate_state['refilled_at'], yahoo_rate_state['backoff_until'])
+    elapsed = max(0.0, now - start)
+    yahoo_rate_state['tokens'] = min(YAHOO_RATE_BURST, yahoo_rate_state['tokens'] + elapsed * YAHOO_RATE_PER_SEC)
+    yahoo_rate_state['refilled_at'] = max(now, start)
+
+def acquire_yahoo_token(max_wait=YAHOO_QUEUE_TIMEOUT):
+    """
+    获取一个Yahoo请求令牌
+    退避期间或令牌不足时排队等待，最多等待max_wait秒
+    返回：(是否获取成功, 需再等待的秒数)
+    """
+    deadline = time.time() + max_wait
+    queued = False
+    try:
+        while True:
+            with yahoo_rate_lock:
+                now = time.time()
+                refill_yahoo_tokens(now)
+                if now < yahoo_rate_state['backoff_until']:
+                    wait = yahoo_rate_state['backoff_until'] - now
+                elif yahoo_rate_state['tokens'] >= 1:
+                    yahoo_rate_state['tokens'] -= 1
+                    return True, 0
+                else:
+                    wait = (1 - yahoo_rate_state['tokens']) / YAHOO_RATE_PER_SEC
+
+                if now + wait > deadline:
+                    return False, wait
+                if not queued:
+                    queued = True
+                    yahoo_rate_state['queued'] += 1
+            time.sleep(min(wait, 1.0))
+    finally:
+        if queued:
+            with yahoo_rate_lock:
+                yahoo_rate_state['queued'] -= 1
+
+def record_yahoo_throttle(reason):
+    """Yahoo返回限流信号：按连续限流次数指数退避，并加入随机抖动避免多个调用方同时恢复"""
+    with yahoo_rate_lock:
+        yahoo_rate_state['consecutive_throttles'] += 1
+        yahoo_rate_state['throttle_count'] += 1
+        delay = min(YAHOO_BACKOFF_MAX, YAHOO_BACKOFF_BASE * 2 ** (yahoo_rate_state['consecutive_throttles'] - 1))
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        yahoo_rate_state['backoff_until'] = max(yahoo_rate_state['backoff_until'], time.time() + delay)
+        yahoo_rate_state['tokens'] = 0.0
+    print(f"[RATE_LIMIT] Yahoo限流({reason})，退避 {delay:.1f} 秒")
+
+def record_yahoo_success():
+    """Yahoo请求成功，重置连续限流计数"""
+    with yahoo_rate_lock:
+        yahoo_rate_state['consecutive_throttles'] = 0
+
+def get_yahoo_rate_limit_state():
+    """返回限流器当前状态：剩余令牌、退避截止时间和排队的调用方数量"""
+    with yahoo_rate_lock:
+        now = time.time()
+        refill_yahoo_tokens(now)
+        backoff_until = yahoo_rate_state['backoff_until']
+        return {
+            'tokens': round(max(0.0, yahoo_rate_state['tokens']), 2),
+            'rate_per_sec': YAHOO_RATE_PER_SEC,
+            'burst': YAHOO_RATE_BURST,
+            'backing_off': now < backoff_until,
+            'backoff_until': datetime.datetime.fromtimestamp(backoff_until).isoformat() if backoff_until > now else None,
+            'backoff_remaining': round(max(0.0, backoff_until - now), 1),
+            'consecutive_throttles': yahoo_rate_state['consecutive_throttles'],
+            'throttle_count': yahoo_rate_state['throttle_count'],
+            'queued': yahoo_rate_state['queued']
+        }
+
 def get_company_name(ticker):
     """获取股票代码对应的公司名称 - 多层级查询机制（容错增强版）"""
     print(f"[DEBUG] 开始获取公司名称: {ticker}")
@@ -719,6 +1099,11 @@ def get_company_name(ticker):
         print("[WARNING] ticker为空，返回默认值")
         return "未知股票"
     
+    # V6.3: 同一ticker的并发查询只走一次缓存/API查询链
+    return single_flight(('company_name', ticker), lookup_company_name, ticker)
+
+def lookup_company_name(ticker):
+    """按 本地缓存 → API → 容错显示 的顺序查询公司名称"""
     # 判断是否为A股代码
     is_a_stock = (ticker.endswith('.SH') or ticker.endswith('.SZ'))
     
@@ -811,7 +1196,7 @@ def fetch_company_name_from_sina_hk(ticker):
             'Referer': 'https://finance.sina.com.cn/'
         }
         
-        response = requests.get(url, headers=headers, timeout=15)
+        response = http_get(url, headers=headers)
         print(f"[API] 新浪财经港股 响应状态码: {response.status_code}")
         
         if response.status_code == 200 and response.text:
@@ -859,7 +1244,7 @@ def fetch_company_name_from_api(ticker):
             'apikey': alpha_vantage_key
         }
         
-        response = requests.get(url, params=params, headers=HEADERS, timeout=15)
+        response = http_get(url, params=params, headers=HEADERS)
         print(f"[API] Alpha Vantage 响应状态码: {response.status_code}")
         
         if response.status_code == 200:
@@ -904,7 +1289,7 @@ def fetch_sz_stock_list():
     
     try:
         url = "http://api.biyingapi.com/hslt/list/biyinglicence"
-        response = requests.get(url, headers=HEADERS, timeout=30)
+        response = http_get(url, headers=HEADERS)
         print(f"[STOCK_LIST] 深圳交易所API响应状态码: {response.status_code}")
         
         if response.status_code == 200:
@@ -1101,102 +1486,1121 @@ def update_stock_list_cache():
     print(f"[STOCK_LIST] ========== 股票名单缓存更新完成，总计: {total_saved} 条 ==========")
     return total_saved
 
-def calculate_zig(series, threshold):
-    if series.isnull().all():
-        return [None] * len(series)
+# --- V6.0: 行情K线本地缓存 ---
+# 所有读取Yahoo K线的接口都从本地缓存取数，只有缓存过期时才请求Yahoo
+PRICE_CACHE_TTL = int(os.environ.get('PRICE_CACHE_TTL', 900))  # 缓存有效期（秒）
+PRICE_HISTORY_DAYS = 365 * 20  # 缓存的历史长度，与stock_data的20年窗口一致
+PRICE_BAR_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+# V6.1: 增量刷新时重新下载的尾部K线数量（覆盖未收盘K线的修订和迟到更正）
+PRICE_REFRESH_OVERLAP = int(os.environ.get('PRICE_REFRESH_OVERLAP', 2))
+PRICE_REWRITE_TOLERANCE = 0.01  # 已收盘K线收盘价变化超过1%视为历史被调整（拆股等）
+# V7.4: 增量刷新时序列头部超出20年窗口这么多天后才裁剪，避免序列起点每天移动使ZIG续算状态失效
+PRICE_HISTORY_TRIM_SLACK_DAYS = 90
+# V6.8: 列式二进制K线文件，每个(ticker, interval)一个文件，可直接numpy.memmap零拷贝读取，
+# 多个gunicorn worker共享同一份page cache
+# 文件布局：64字节文件头（魔数、K线数量、刷新时间、历史版本）+ 按列连续存放的 timestamp/open/high/low/close/volume
+# V7.4: 历史版本为最近一次下载完整历史的时间，增量刷新时沿用，只有完整重新下载（如拆股调整）才会改变
+PRICE_STORE_DIR = os.environ.get('PRICE_STORE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'price_bars'))
+PRICE_FILE_MAGIC = b'MNBARS01'
+PRICE_FILE_HEADER_SIZE = 64
+PRICE_BAR_DTYPES = {
+    'timestamp': np.dtype('<i8'),
+    'open': np.dtype('<f8'),
+    'high': np.dtype('<f8'),
+    'low': np.dtype('<f8'),
+    'close': np.dtype('<f8'),
+    'volume': np.dtype('<i8')
+}
+
+def fetch_yahoo_chart(yahoo_ticker, interval, period1, period2, max_wait=YAHOO_QUEUE_TIMEOUT):
+    """
+    从Yahoo Finance下载K线数据
+    max_wait: 限流时最多排队等待的秒数
+    返回：(DataFrame, 错误类型, 错误详情)，成功时错误类型为None
+    """
+    # V6.4: 先从令牌桶取得请求许可，退避期间不请求Yahoo
+    acquired, retry_after = acquire_yahoo_token(max_wait)
+    if not acquired:
+        print(f"[RATE_LIMIT] Yahoo请求排队超时: {yahoo_ticker} {interval}，约 {retry_after:.0f} 秒后可重试")
+        return None, 'rate_limited', int(retry_after) + 1
+
+    url = f"https://query1.finance.yahoo.com/v8/finance/chart/{yahoo_ticker}?period1={period1}&period2={period2}&interval={interval}"
+    print(f"[PRICE_CACHE] 请求Yahoo Finance API: {url}")
+
+    response = http_get(url, headers=HEADERS)
+    if response.status_code == 429:
+        record_yahoo_throttle('HTTP 429')
+        error_text = response.text[:200] if response.text else "Too Many Requests"
+        return None, 'invalid_response', error_text
+    response.raise_for_status()
+
+    # 安全地解析JSON响应
+    try:
+        yahoo_data = response.json()
+    except ValueError:
+        # 响应不是有效的JSON（如"Too Many Requests"文本）
+        error_text = response.text[:200] if response.text else "无响应内容"
+        print(f"[ERROR] Yahoo Finance API返回非JSON响应: {error_text}")
+        record_yahoo_throttle('非JSON响应')
+        return None, 'invalid_response', error_text
+    record_yahoo_success()
+
+    result = yahoo_data.get('chart', {}).get('result', [])
+    if not result:
+        return None, 'not_found', None
+
+    res = result[0]
+    timestamps = res.get('timestamp', [])
+
+    # 安全地获取quote数据，避免list index out of range
+    quote_list = res.get('indicators', {}).get('quote', [])
+    if not quote_list:
+        print(f"[ERROR] Yahoo Finance返回的数据中没有quote信息")
+        return None, 'no_quote', None
+
+    ohlc = quote_list[0]
+    if not timestamps or not ohlc.get('open'):
+        return None, 'incomplete', None
+
+    df = pd.DataFrame({
+        'timestamp': timestamps,
+        'open': ohlc['open'],
+        'high': ohlc['high'],
+        'low': ohlc['low'],
+        'close': ohlc['close'],
+        'volume': ohlc.get('volume', [0] * len(timestamps))
+    })
+
+    # 移除空值行并重建连续索引（ZIG等按位置计算的指标依赖连续索引）
+    df = df.dropna().reset_index(drop=True)
+    df['timestamp'] = df['timestamp'].astype('int64')
+    df['volume'] = df['volume'].astype('int64')
+    return df, None, None
+
+def price_store_path(yahoo_ticker, interval):
+    """K线文件路径：<PRICE_STORE_DIR>/<interval>/<转义后的ticker>.bars"""
+    return os.path.join(PRICE_STORE_DIR, interval, urllib.parse.quote(yahoo_ticker, safe='') + '.bars')
+
+def load_price_columns(yahoo_ticker, interval):
+    """
+    以memmap方式打开K线文件，返回({列名: 只读数组}, 刷新时间, 历史版本)，无缓存时返回(None, None, None)
+    各列数组都是同一块映射内存上的视图，不复制数据
+    """
+    path = price_store_path(yahoo_ticker, interval)
+    if not os.path.exists(path):
+        return None, None, None
+    try:
+        mapped = np.memmap(path, dtype=np.uint8, mode='r')
+        if mapped[:len(PRICE_FILE_MAGIC)].tobytes() != PRICE_FILE_MAGIC:
+            print(f"[ERROR] K线文件格式不正确: {path}")
+            return None, None, None
+        count = int(mapped[8:16].view('<i8')[0])
+        fetched_at = float(mapped[16:24].view('<f8')[0])
+        generation = float(mapped[24:32].view('<f8')[0])
+
+        columns = {}
+        offset = PRICE_FILE_HEADER_SIZE
+        for name in PRICE_BAR_COLUMNS:
+            dtype = PRICE_BAR_DTYPES[name]
+            size = count * dtype.itemsize
+            columns[name] = mapped[offset:offset + size].view(dtype)
+            offset += size
+        return columns, fetched_at, generation
+    except Exception as e:
+        print(f"[ERROR] 读取K线缓存失败: {e}")
+        return None, None, None
+
+def load_cached_bars(yahoo_ticker, interval):
+    """读取缓存的K线，返回(DataFrame, 刷新时间, 历史版本)，无缓存时返回(None, None, None)"""
+    columns, fetched_at, generation = load_price_columns(yahoo_ticker, interval)
+    if columns is None:
+        return None, None, None
+    return pd.DataFrame(columns, columns=PRICE_BAR_COLUMNS), fetched_at, generation
+
+def save_cached_bars(yahoo_ticker, interval, df, generation=None):
+    """
+    将完整K线序列写入列式文件缓存
+    先写临时文件再原子替换，正在读取旧文件映射的进程不受影响
+    generation: 历史版本，增量刷新时传入原文件的版本，为None表示完整历史，以当前时间作为新版本
+    """
+    path = price_store_path(yahoo_ticker, interval)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    now = time.time()
+    if generation is None:
+        generation = now
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        header = PRICE_FILE_MAGIC + np.array([len(df)], dtype='<i8').tobytes() + np.array([now, generation], dtype='<f8').tobytes()
+        with open(tmp_path, 'wb') as f:
+            f.write(header.ljust(PRICE_FILE_HEADER_SIZE, b'\0'))
+            for name in PRICE_BAR_COLUMNS:
+                f.write(np.ascontiguousarray(df[name].to_numpy(dtype=PRICE_BAR_DTYPES[name])).tobytes())
+        os.replace(tmp_path, path)
+        print(f"[PRICE_CACHE] 缓存已更新: {yahoo_ticker} {interval}，共 {len(df)} 根K线")
+        return True
+    except Exception as e:
+        print(f"[ERROR] 写入K线缓存失败: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+def merge_price_bars(cached_df, fresh_df, period1):
+    """
+    将增量下载的尾部K线合并进缓存序列
+    重叠区间内以新数据为准（覆盖当日未收盘K线的修订和迟到的更正）
+    返回：(合并后的DataFrame, 是否检测到历史被整体调整)
+    """
+    if fresh_df.empty:
+        return cached_df, False
+
+    # Yahoo对未收盘K线使用最新成交时间作为时间戳，收盘后会变为开盘时间戳，
+    # 因此以请求起点和新数据首根K线中较早者为界，界线之后的旧K线全部替换
+    replace_from = min(period1, int(fresh_df['timestamp'].iloc[0]))
+
+    # 对比重叠区间内已收盘的K线（排除缓存中的最后一根），差异过大通常意味着拆股等历史复权
+    overlap = cached_df[cached_df['timestamp'] >= replace_from].iloc[:-1]
+    if not overlap.empty:
+        compared = overlap[['timestamp', 'close']].merge(
+            fresh_df[['timestamp', 'close']], on='timestamp', suffixes=('_cached', '_fresh'))
+        if not compared.empty:
+            drift = ((compared['close_fresh'] - compared['close_cached']).abs() / compared['close_cached'].abs()).max()
+            if drift > PRICE_REWRITE_TOLERANCE:
+                return None, True
+
+    head = cached_df[cached_df['timestamp'] < replace_from]
+    merged = pd.concat([head, fresh_df], ignore_index=True)
+    return merged, False
+
+def resample_price_bars(daily, interval):
+    """
+    V6.5: 由日线合成周线/月线（开=首、高=最大、低=最小、收=末、量=求和）
+    周线按周一开始的自然周分组，月线按自然月分组，时间戳取该周期内第一根日线的时间戳
+    daily: 日线行情序列（列名 -> 数组），返回同样结构的周线/月线序列
+    """
+    ts = np.asarray(daily['timestamp'], dtype='int64')
+    if len(ts) == 0:
+        return {name: np.asarray(daily[name]) for name in PRICE_BAR_COLUMNS}
+
+    if interval == '1wk':
+        # 1970-01-01为周四，偏移3天后按7天整除即得以周一开始的周编号
+        bucket = (ts // 86400 + 3) // 7
+    else:
+        bucket = ts.astype('datetime64[s]').astype('datetime64[M]').astype('int64')
+
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(bucket)) + 1))
+    ends = np.concatenate((starts[1:], [len(ts)])) - 1
+
+    return {
+        'timestamp': ts[starts],
+        'open': np.asarray(daily['open'])[starts],
+        'high': np.maximum.reduceat(np.asarray(daily['high']), starts),
+        'low': np.minimum.reduceat(np.asarray(daily['low']), starts),
+        'close': np.asarray(daily['close'])[ends],
+        'volume': np.add.reduceat(np.asarray(daily['volume'], dtype='int64'), starts)
+    }
+
+# --- V7.0: 统一行情序列 ---
+# 四个图表接口（stock_data / analysis_data / trend_analysis / 单日股价）都通过get_price_series取数：
+# 返回只读的列数组（日线为K线文件的memmap视图，周线/月线为本地合成结果），各接口按时间截取视图，
+# 同一次下载和同一份缓存服务所有接口
+PRICE_SERIES_CACHE_SIZE = 256  # 进程内缓存的序列数量（已打开的K线文件映射和合成的周线/月线）
+price_series_cache = OrderedDict()
+price_series_lock = threading.Lock()
+
+def freeze_price_series(columns, version, generation=None):
+    """
+    把列数组标记为只读并附上版本号（K线文件的刷新时间），得到不可变的行情序列
+    generation: K线文件的历史版本（ZIG续算状态据此校验），为None表示序列未落盘
+    """
+    series = {'version': version, 'generation': generation}
+    for name in PRICE_BAR_COLUMNS:
+        arr = np.asarray(columns[name], dtype=PRICE_BAR_DTYPES[name])
+        arr.flags.writeable = False
+        series[name] = arr
+    return series
+
+def cache_price_series(key, stamp, series):
+    """写入进程内序列缓存，超出容量时淘汰最久未使用的条目"""
+    with price_series_lock:
+        price_series_cache[key] = (stamp, series)
+        price_series_cache.move_to_end(key)
+        while len(price_series_cache) > PRICE_SERIES_CACHE_SIZE:
+            price_series_cache.popitem(last=False)
+
+def get_cached_price_series(key, stamp):
+    """读取进程内序列缓存，stamp不一致（文件已被替换或日线已更新）时视为未命中"""
+    with price_series_lock:
+        entry = price_series_cache.get(key)
+        if entry is None or entry[0] != stamp:
+            return None
+        price_series_cache.move_to_end(key)
+        return entry[1]
+
+def open_price_series(yahoo_ticker, interval):
+    """打开K线文件对应的只读序列（按文件inode和修改时间复用已有映射），无缓存时返回None"""
+    path = price_store_path(yahoo_ticker, interval)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    series = get_cached_price_series((yahoo_ticker, interval), stamp)
+    if series is None:
+        columns, fetched_at, generation = load_price_columns(yahoo_ticker, interval)
+        if columns is None:
+            return None
+        series = freeze_price_series(columns, fetched_at, generation)
+        cache_price_series((yahoo_ticker, interval), stamp, series)
+    return series
+
+def slice_price_series(series, start=None, end=None):
+    """按时间戳截取[start, end]区间，返回共享底层数组的视图（不复制数据）"""
+    ts = series['timestamp']
+    lo = 0 if start is None else int(np.searchsorted(ts, start, side='left'))
+    hi = len(ts) if end is None else int(np.searchsorted(ts, end, side='right'))
+    if lo == 0 and hi == len(ts):
+        return series
+    sliced = {'version': series['version'], 'generation': series['generation']}
+    for name in PRICE_BAR_COLUMNS:
+        sliced[name] = series[name][lo:hi]
+    return sliced
+
+def price_series_to_frame(series):
+    """由行情序列构造可修改的DataFrame，供需要追加指标列的接口使用"""
+    return pd.DataFrame({name: series[name] for name in PRICE_BAR_COLUMNS}, columns=PRICE_BAR_COLUMNS)
+
+def get_price_series(yahoo_ticker, interval='1d', start=None, end=None, force_refresh=False, max_wait=None):
+    """
+    获取K线序列（缓存优先），按[start, end]截取后返回
+    缓存未过期时直接返回本地数据；过期时只向Yahoo请求最后几根K线之后的增量并合并，
+    无缓存或检测到历史被调整时才下载完整历史；刷新失败则退回过期缓存
+    周线/月线由日线缓存在本地合成，切换周期不再请求网络
+    force_refresh: 忽略缓存有效期强制刷新（收盘后预取使用）
+    max_wait: 限流时最多排队等待的秒数，为None时有缓存不等待、无缓存等待YAHOO_QUEUE_TIMEOUT
+    返回：(行情序列, 错误类型, 错误详情)
+    """
+    if interval in ('1wk', '1mo'):
+        daily, error_type, error_detail = get_price_series(yahoo_ticker, '1d', force_refresh=force_refresh, max_wait=max_wait)
+        if daily is None:
+            return None, error_type, error_detail
+        # 合成结果按日线版本缓存，日线未更新时直接复用
+        stamp = (daily['version'], len(daily['timestamp']))
+        series = get_cached_price_series((yahoo_ticker, interval), stamp)
+        if series is None:
+            series = freeze_price_series(resample_price_bars(daily, interval), daily['version'], daily['generation'])
+            cache_price_series((yahoo_ticker, interval), stamp, series)
+        return slice_price_series(series, start, end), None, None
+
+    if not force_refresh:
+        series = open_price_series(yahoo_ticker, interval)
+        if series is not None and time.time() - series['version'] < PRICE_CACHE_TTL:
+            print(f"[PRICE_CACHE] 命中缓存: {yahoo_ticker} {interval}，共 {len(series['timestamp'])} 根K线")
+            return slice_price_series(series, start, end), None, None
+
+    # V6.3: 同一(ticker, interval)的并发刷新只请求一次Yahoo
+    df, error_type, error_detail = single_flight(('price_history', yahoo_ticker, interval),
+                                                 refresh_price_history, yahoo_ticker, interval, force_refresh, max_wait)
+    if df is None:
+        return None, error_type, error_detail
+
+    # 刷新结果已写入K线文件，重新映射；文件与刷新结果不一致（如写入失败）时直接使用刷新结果
+    series = open_price_series(yahoo_ticker, interval)
+    if series is None or len(series['timestamp']) != len(df) or \
+            (len(df) and int(series['timestamp'][-1]) != int(df['timestamp'].iloc[-1])):
+        series = freeze_price_series({name: df[name].to_numpy() for name in PRICE_BAR_COLUMNS}, time.time())
+    return slice_price_series(series, start, end), None, None
+
+def refresh_price_history(yahoo_ticker, interval, force_refresh=False, max_wait=None):
+    """从Yahoo刷新K线缓存（有缓存时增量刷新），返回(DataFrame, 错误类型, 错误详情)"""
+    # 排队期间其他线程可能刚完成刷新，重新检查一次缓存
+    cached_df, fetched_at, generation = load_cached_bars(yahoo_ticker, interval)
+    if not force_refresh and cached_df is not None and time.time() - fetched_at < PRICE_CACHE_TTL:
+        return cached_df, None, None
+
+    period2 = int(time.time())
+    window_start = period2 - PRICE_HISTORY_DAYS * 86400
+    incremental = cached_df is not None and not cached_df.empty
+    if incremental:
+        # 从倒数第N根K线开始重新下载，用于覆盖最后一根K线的修订和近期的迟到更正
+        overlap_bars = max(1, min(PRICE_REFRESH_OVERLAP, len(cached_df)))
+        period1 = int(cached_df['timestamp'].iloc[-overlap_bars])
+        print(f"[PRICE_CACHE] 增量刷新: {yahoo_ticker} {interval}，起点 {period1}")
+    else:
+        period1 = window_start
+
+    try:
+        # V6.4: 有缓存时不排队等待限流，直接退回缓存
+        if max_wait is None:
+            max_wait = 0 if cached_df is not None else YAHOO_QUEUE_TIMEOUT
+        df, error_type, error_detail = fetch_yahoo_chart(yahoo_ticker, interval, period1, period2, max_wait)
+    except requests.exceptions.RequestException as e:
+        if cached_df is not None:
+            print(f"[WARNING] Yahoo刷新失败，使用过期缓存: {yahoo_ticker} {interval} ({e})")
+            return cached_df, None, None
+        raise
+
+    if df is None:
+        if cached_df is not None:
+            print(f"[WARNING] Yahoo刷新失败({error_type})，使用过期缓存: {yahoo_ticker} {interval}")
+            return cached_df, None, None
+        return None, error_type, error_detail
+
+    if incremental:
+        merged, rewritten = merge_price_bars(cached_df, df, period1)
+        if not rewritten:
+            # V7.4: 头部超出窗口较多时才裁剪，保持序列起点稳定
+            if int(merged['timestamp'].iloc[0]) < window_start - PRICE_HISTORY_TRIM_SLACK_DAYS * 86400:
+                merged = merged[merged['timestamp'] >= window_start].reset_index(drop=True)
+            save_cached_bars(yahoo_ticker, interval, merged, generation)
+            return merged, None, None
+
+        # 历史K线被整体调整（如拆股），重新下载完整历史
+        print(f"[PRICE_CACHE] 检测到历史K线被调整，重新下载完整历史: {yahoo_ticker} {interval}")
+        df, error_type, error_detail = fetch_yahoo_chart(yahoo_ticker, interval, window_start, period2, max_wait)
+        if df is None:
+            return cached_df, None, None
+
+    save_cached_bars(yahoo_ticker, interval, df)
+    return df, None, None
+
+# --- V7.2: 向量化ZIG引擎 ---
+# 与原逐点循环的语义完全一致：起点为第一个有效值；未定方向时等待相对起点的涨跌幅超过阈值；
+# 上升段中创新高则替换当前拐点（相同价格保留较早的点），回撤超过阈值则在该点反转为下降段，下降段对称。
+# 先剔除NaN得到连续数组，每一段用累计最大/最小值向量化查找反转点；
+# 查找窗口从上一段的长度开始按倍数扩展，既不逐点循环，也不必每段都扫描到序列末尾
+ZIG_MIN_WINDOW = 16  # 最小查找窗口长度
+
+def find_zig_reversal(values, start, direction, threshold, window, lo=None, extreme=None):
+    """
+    从拐点start开始查找当前段的反转点（values不含NaN）
+    direction=1为上升段（跟踪最高价），-1为下降段（跟踪最低价），返回反转点下标，到序列末尾都未反转时返回None
+    lo/extreme: 续算时从lo开始查找，extreme为本段在lo之前的最高（最低）价
+    """
+    n = len(values)
+    if lo is None:
+        lo, extreme = start + 1, values[start]
+    while lo < n:
+        hi = min(n, lo + window)
+        segment = values[lo:hi]
+        previous = np.empty_like(segment)
+        previous[0] = extreme
+        if direction == 1:
+            running = np.maximum.accumulate(segment)
+            np.maximum(running[:-1], extreme, out=previous[1:])
+            reversed_mask = (segment <= previous) & (segment / previous < 1 - threshold)
+        else:
+            running = np.minimum.accumulate(segment)
+            np.minimum(running[:-1], extreme, out=previous[1:])
+            reversed_mask = (segment >= previous) & (segment / previous > 1 + threshold)
+        hit = int(reversed_mask.argmax())
+        if reversed_mask[hit]:
+            return lo + hit
+        extreme = max(extreme, running[-1]) if direction == 1 else min(extreme, running[-1])
+        lo = hi
+        window *= 2
+    return None
 
-    # 找到第一个有效值作为起点
-    first_valid_index = series.first_valid_index()
-    if first_valid_index is None:
-        return [None] * len(series)
+def find_zig_breakout(values, threshold, lo=1):
+    """未定方向时从lo开始查找第一个相对起点涨跌幅超过阈值的点（values不含NaN），返回(下标, 方向)，未找到返回(None, 0)"""
+    n = len(values)
+    base = values[0]
+    window = ZIG_MIN_WINDOW
+    while lo < n:
+        hi = min(n, lo + window)
+        ratio = values[lo:hi] / base
+        up = ratio > 1 + threshold
+        moved = up | (ratio < 1 - threshold)
+        hit = int(moved.argmax())
+        if moved[hit]:
+            return lo + hit, (1 if up[hit] else -1)
+        lo = hi
+        window *= 2
+    return None, 0
+
+def new_zig_state():
+    """
+    V7.4: ZIG状态机的初始状态（下标均为不含NaN的连续数组中的位置）
+    pivots: 已确定的拐点；start/direction: 当前段的起点和方向（start为None表示尚未突破阈值）；
+    pivot: 当前段的暂定拐点；scanned: 已处理的数值个数；window: 下一次查找窗口长度
+    """
+    return {'pivots': [0], 'start': None, 'direction': 0, 'pivot': None, 'scanned': 1, 'window': ZIG_MIN_WINDOW}
 
+def advance_zig_state(compact, threshold, state):
+    """
+    把ZIG状态推进到compact末尾，只处理state['scanned']之后的数值，就地更新并返回state
+    compact的前state['scanned']个数值必须与生成该状态时相同
+    """
     threshold = threshold / 100.0
-    trend = 0  # 0: TBD, 1: up, -1: down
-    last_pivot_price = series[first_valid_index]
-    last_pivot_index = first_valid_index
-    pivots = {last_pivot_index: last_pivot_price}
-
-    for i in range(first_valid_index + 1, len(series)):
-        current_price = series.iloc[i]
-        if pd.isna(current_price):
+    n = len(compact)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if state['start'] is None:
+            start, direction = find_zig_breakout(compact, threshold, state['scanned'])
+            if start is None:
+                state['scanned'] = max(state['scanned'], n)
+                return state
+            state.update(start=start, direction=direction, pivot=start, scanned=start + 1)
+
+        while True:
+            start, direction, lo = state['start'], state['direction'], state['scanned']
+            end = find_zig_reversal(compact, start, direction, threshold, state['window'],
+                                    lo=lo, extreme=compact[state['pivot']])
+            stop = n if end is None else end
+            # 本段的拐点是段内第一个出现的最高（最低）价，新数值严格更高（更低）时才替换
+            if stop > lo:
+                if direction == 1:
+                    candidate = lo + int(np.argmax(compact[lo:stop]))
+                    if compact[candidate] > compact[state['pivot']]:
+                        state['pivot'] = candidate
+                else:
+                    candidate = lo + int(np.argmin(compact[lo:stop]))
+                    if compact[candidate] < compact[state['pivot']]:
+                        state['pivot'] = candidate
+            if end is None:
+                state['scanned'] = max(lo, n)
+                return state
+            state['pivots'].append(state['pivot'])
+            state['window'] = max(ZIG_MIN_WINDOW, 2 * (end - start))
+            state.update(start=end, direction=-direction, pivot=end, scanned=end + 1)
+
+def zig_state_pivots(state):
+    """状态对应的全部拐点：已确定的拐点加上当前段的暂定拐点"""
+    if state['start'] is None:
+        return list(state['pivots'])
+    return state['pivots'] + [state['pivot']]
+
+def find_zig_pivots_compact(compact, threshold):
+    """在不含NaN的连续数组上计算ZIG拐点，threshold为百分比阈值，返回拐点在compact中的下标列表"""
+    return zig_state_pivots(advance_zig_state(compact, threshold, new_zig_state()))
+
+def calculate_zig_pivots_multi(values, thresholds):
+    """
+    V7.3: 同一序列一次计算多个阈值的ZIG拐点
+    NaN剔除和连续数组只构建一次，各阈值共享；重复的阈值只计算一次
+    返回：{阈值: (拐点下标数组, 拐点数值数组)}，下标为在values中的位置
+    """
+    values = np.ascontiguousarray(values, dtype='float64')
+    positions = np.flatnonzero(~np.isnan(values))
+    results = {}
+    if positions.size == 0:
+        for threshold in thresholds:
+            results[threshold] = (np.empty(0, dtype='int64'), np.empty(0, dtype='float64'))
+        return results
+
+    compact = values[positions]
+    for threshold in thresholds:
+        if threshold in results:
             continue
+        indices = positions[find_zig_pivots_compact(compact, threshold)]
+        results[threshold] = (indices, values[indices])
+    return results
 
-        if trend == 0:
-            if current_price / last_pivot_price > 1 + threshold:
-                trend = 1
-                pivots[i] = current_price
-                last_pivot_price = current_price
-                last_pivot_index = i
-            elif current_price / last_pivot_price < 1 - threshold:
-                trend = -1
-                pivots[i] = current_price
-                last_pivot_price = current_price
-                last_pivot_index = i
-        elif trend == 1:
-            if current_price > last_pivot_price:
-                pivots.pop(last_pivot_index)
-                pivots[i] = current_price
-                last_pivot_price = current_price
-                last_pivot_index = i
-            elif current_price / last_pivot_price < 1 - threshold:
-                trend = -1
-                pivots[i] = current_price
-                last_pivot_price = current_price
-                last_pivot_index = i
-        elif trend == -1:
-            if current_price < last_pivot_price:
-                pivots.pop(last_pivot_index)
-                pivots[i] = current_price
-                last_pivot_price = current_price
-                last_pivot_index = i
-            elif current_price / last_pivot_price > 1 + threshold:
-                trend = 1
-                pivots[i] = current_price
-                last_pivot_price = current_price
-                last_pivot_index = i
-
-    zig_series = pd.Series([np.nan] * len(series), index=series.index)
-    for index, value in pivots.items():
-        zig_series.loc[index] = value
-
-    # 关键修复：将所有NaN替换为None，以便正确转换为JSON的null
-    return [None if pd.isna(x) else x for x in zig_series]
-
-def calculate_phases_from_zig(zig_series, timestamps):
-    import datetime as dt
-    pivots = [(i, v) for i, v in enumerate(zig_series) if v is not None]
-    if len(pivots) < 2:
-        return []
+def calculate_zig_pivots(values, threshold):
+    """
+    计算ZIG拐点
+    values: 一维浮点数组（可含NaN，NaN视为缺失跳过），threshold: 百分比阈值
+    返回：(拐点下标数组, 拐点数值数组)，下标为在values中的位置
+    """
+    return calculate_zig_pivots_multi(values, [threshold])[threshold]
+
+def summarize_zig_pivots(pivot_values):
+    """统计拐点划分出的区间：区间数、上涨/下跌区间数（与calculate_phases_from_pivots的判断一致）"""
+    moves = np.diff(pivot_values)
+    uptrends = int(np.count_nonzero(moves > 0))
+    return {
+        'pivot_count': int(len(pivot_values)),
+        'phase_count': int(len(moves)),
+        'uptrend_count': uptrends,
+        'downtrend_count': int(len(moves)) - uptrends
+    }
+
+def calculate_zig(series, threshold):
+    """计算ZIG指标，返回与series等长的列表：拐点处为数值，其余为None"""
+    indices, pivot_values = calculate_zig_pivots(np.asarray(series, dtype='float64'), threshold)
+    return zig_pivots_to_list(len(series), indices, pivot_values)
+
+# --- V7.4: ZIG续算状态持久化 ---
+# ZIG是因果状态机：新K线只会改变最后一段的拐点。每个(ticker, 周期)的ZIG状态按(指标, 阈值)保存在K线文件旁的
+# <ticker>.zig.json中，只覆盖已收盘的K线（最后PRICE_REFRESH_OVERLAP根可能被增量刷新修订，不计入状态）；
+# 下次请求从状态续算新增的K线，每日刷新后的计算量与新增K线数量相当，而不是与整段历史成正比。
+# 状态记录K线文件的历史版本、序列首根和最后一根已收盘K线的时间戳，任一不一致（完整重新下载、头部裁剪）即重新计算
+ZIG_STATE_MAX_ENTRIES = 32  # 每个文件保留的状态数量（按最近更新时间淘汰）
+
+def zig_state_path(yahoo_ticker, interval):
+    """ZIG状态文件路径，与K线文件同目录"""
+    return os.path.splitext(price_store_path(yahoo_ticker, interval))[0] + '.zig.json'
+
+def load_zig_states(yahoo_ticker, interval):
+    """读取ZIG状态，返回{状态键: 状态记录}，文件不存在或损坏时返回空字典"""
+    path = zig_state_path(yahoo_ticker, interval)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"[ERROR] 读取ZIG状态失败: {e}")
+        return {}
+
+def save_zig_states(yahoo_ticker, interval, states):
+    """写入ZIG状态（临时文件 + 原子替换），只保留最近更新的ZIG_STATE_MAX_ENTRIES条"""
+    path = zig_state_path(yahoo_ticker, interval)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    kept = sorted(states.items(), key=lambda item: item[1]['updated_at'], reverse=True)[:ZIG_STATE_MAX_ENTRIES]
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(kept), f)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"[ERROR] 写入ZIG状态失败: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def resume_zig_pivots(values, threshold, series, record):
+    """
+    从持久化状态续算ZIG拐点
+    values: 与series等长的指标数组，series: 行情序列（提供历史版本和时间戳用于校验状态），record: 已保存的状态记录或None
+    返回：(拐点下标数组, 拐点数值数组, 新状态记录)，状态未变化时新状态记录就是record，序列未落盘时为None
+    """
+    values = np.ascontiguousarray(values, dtype='float64')
+    positions = np.flatnonzero(~np.isnan(values))
+    if positions.size == 0:
+        return np.empty(0, dtype='int64'), np.empty(0, dtype='float64'), record
+    compact = values[positions]
+
+    timestamps = series['timestamp']
+    settled_bars = len(values) - PRICE_REFRESH_OVERLAP
+    settled = int(np.searchsorted(positions, settled_bars))  # 已收盘K线对应的有效数值个数
+    persistent = series.get('generation') is not None and settled >= 1
+
+    resumed = persistent and record is not None and record['generation'] == series['generation'] \
+        and record['first_ts'] == int(timestamps[0]) and record['bars'] <= settled_bars \
+        and int(timestamps[record['bars'] - 1]) == record['last_ts']
+    state = copy.deepcopy(record['state']) if resumed else new_zig_state()
+
+    if persistent and (not resumed or record['bars'] != settled_bars):
+        advance_zig_state(compact[:settled], threshold, state)
+        record = {
+            'generation': series['generation'],
+            'first_ts': int(timestamps[0]),
+            'bars': settled_bars,
+            'last_ts': int(timestamps[settled_bars - 1]),
+            'updated_at': time.time(),
+            'state': copy.deepcopy(state)
+        }
 
-    # 添加边界检查，确保所有pivot索引都在timestamps范围内
-    max_index = len(timestamps) - 1
-    valid_pivots = [(i, v) for i, v in pivots if i <= max_index]
+    indices = positions[zig_state_pivots(advance_zig_state(compact, threshold, state))]
+    return indices, values[indices], record
 
-    if len(valid_pivots) < 2:
-        print(f"[WARNING] 有效pivot数量不足: {len(valid_pivots)}, timestamps长度: {len(timestamps)}")
+def calculate_phases_from_pivots(indices, pivot_values, dates):
+    """
+    由ZIG拐点划分上涨/下跌区间：相邻两个拐点构成一个区间，终点数值高于起点为Uptrend，否则为Downtrend
+    indices / pivot_values: 拐点下标和数值数组，dates: 每根K线的日期字符串数组
+    V8.2: 直接由拐点数组批量取日期和方向，不再遍历整条序列和逐点格式化时间戳
+    """
+    if len(indices) < 2:
         return []
+    pivot_dates = dates[indices].tolist()
+    phase_types = np.where(pivot_values[1:] > pivot_values[:-1], 'Uptrend', 'Downtrend').tolist()
+    return [
+        {'start_date': start_date, 'end_date': end_date, 'phase': phase_type}
+        for start_date, end_date, phase_type in zip(pivot_dates[:-1], pivot_dates[1:], phase_types)
+    ]
+
+# --- V7.5: 向量化异常检测 ---
+# stock_data和analysis_data共用的异常规则：全部以数组运算求值，事件以列式结构返回（行下标、规则编号、涨跌幅等），
+# 日期和文字标签一次性批量格式化，不再逐行iterrows
+ANOMALY_ANALYSIS_PERIOD = 60  # 动态基准的统计窗口（周期数）
+ANOMALY_STABLE_PRICE_PCT = 0.01  # 涨跌幅绝对值低于1%视为价格稳定
+
+def format_local_dates(timestamps):
+    """
+    批量把Unix时间戳格式化为本地时区的YYYY-MM-DD字符串（与datetime.fromtimestamp(...).strftime一致）
+    本地时区取自TZ环境变量或/etc/localtime，包含历史夏令时规则
+    """
+    ts = np.asarray(timestamps, dtype='int64')
+    local_tz = dateutil_tz.gettz() or dateutil_tz.tzlocal()
+    local = pd.to_datetime(ts, unit='s', utc=True).tz_convert(local_tz).tz_localize(None)
+    return np.datetime_as_string(local.values.astype('datetime64[D]'))
+
+# --- V7.9: 异常检测器插件 ---
+# 异常条件（register_anomaly_condition）是作用于滚动统计的向量化布尔掩码；检测器（register_anomaly_detector）
+# 声明优先级、需要同时满足的条件(requires)和需要排除的条件或更高优先级检测器(excludes)，以及保存注释时记录的参数
+# 和批量生成注释文字/事件类型的函数。检测器按优先级依次求值，每个条件在一次检测中只算一次，
+# 并记录每个检测器的耗时（含其首次用到的条件），见 /api/system/anomaly-detectors。
+# 新增检测器只需注册条件和检测器，stock_data和analysis_data无需改动
+ANOMALY_CONDITIONS = {}
+ANOMALY_DETECTORS = {}
+ANOMALY_RULES = []  # 按优先级排列的检测器名称，事件的规则编号即下标
+anomaly_detector_timings = {}
+anomaly_detector_lock = threading.Lock()
+
+def register_anomaly_condition(name):
+    """
+    注册异常条件的装饰器
+    条件函数收到 (滚动统计, 参数字典)，返回与K线等长的布尔数组
+    """
+    def decorator(fn):
+        ANOMALY_CONDITIONS[name] = fn
+        return fn
+    return decorator
 
-    phases = []
-    for i in range(len(valid_pivots) - 1):
-        start_index, start_value = valid_pivots[i]
-        end_index, end_value = valid_pivots[i+1]
+def register_anomaly_detector(name, priority, requires, excludes=(), params=(), text=None, event_type=None):
+    """
+    注册异常检测器
+    priority: 越小越先求值，事件按优先级排列；excludes中可以引用条件名或优先级更高的检测器名
+    params: 保存算法注释时记录的参数名
+    text / event_type: 由涨跌幅数组批量生成stock_data注释文字和analysis_data事件类型的函数
+    """
+    ANOMALY_DETECTORS[name] = {
+        'name': name,
+        'priority': priority,
+        'requires': list(requires),
+        'excludes': list(excludes),
+        'params': list(params),
+        'text': text,
+        'event_type': event_type
+    }
+    ANOMALY_RULES[:] = sorted(ANOMALY_DETECTORS, key=lambda rule: ANOMALY_DETECTORS[rule]['priority'])
+
+@register_anomaly_condition('abnormal_price')
+def condition_abnormal_price(stats, params):
+    """价量齐升/跌用的价格异常：涨跌幅超过 price_std 倍标准差"""
+    return np.abs(stats['price_change_pct']) > stats['price_change_std'] * params['price_std']
+
+@register_anomaly_condition('abnormal_price_only')
+def condition_abnormal_price_only(stats, params):
+    """单独的价格异常：涨跌幅超过 price_only_std 倍标准差"""
+    return np.abs(stats['price_change_pct']) > stats['price_change_std'] * params['price_only_std']
+
+@register_anomaly_condition('abnormal_volume')
+def condition_abnormal_volume(stats, params):
+    """成交量异常：超过60周期均值 + volume_std 倍标准差"""
+    return stats['volume'] > stats['volume_ma'][ANOMALY_ANALYSIS_PERIOD] + stats['volume_std'] * params['volume_std']
+
+@register_anomaly_condition('abnormal_volume_only')
+def condition_abnormal_volume_only(stats, params):
+    """单独的成交量异常：超过60周期均值 + volume_only_std 倍标准差"""
+    return stats['volume'] > stats['volume_ma'][ANOMALY_ANALYSIS_PERIOD] + stats['volume_std'] * params['volume_only_std']
+
+@register_anomaly_condition('stable_price')
+def condition_stable_price(stats, params):
+    """价格稳定：涨跌幅绝对值低于1%"""
+    return np.abs(stats['price_change_pct']) < ANOMALY_STABLE_PRICE_PCT
+
+def format_pct_text(pct):
+    """批量格式化涨跌幅，如 5.12%（与 f'{x:.2%}' 一致）"""
+    return np.char.mod('%.2f%%', pct * 100)
+
+def rise_fall_labels(pct):
+    return np.where(pct > 0, '上涨', '下跌')
+
+register_anomaly_detector(
+    'price_volume', priority=10,
+    requires=['abnormal_price', 'abnormal_volume'],
+    params=['price_std', 'volume_std'],
+    text=lambda pct: reduce(np.char.add, ['[价量齐', rise_fall_labels(pct), '] 波动: ', format_pct_text(pct)]),
+    event_type=rise_fall_labels)
+
+register_anomaly_detector(
+    'volume_stable_price', priority=20,
+    requires=['abnormal_volume', 'stable_price'],
+    params=['volume_std'],
+    text=lambda pct: reduce(np.char.add, [
+        '[放量滞', np.where(pct > 0, '上涨', np.where(pct < 0, '下跌', '平盘')), '] 波动: ', format_pct_text(pct)]),
+    event_type=lambda pct: np.where(pct >= 0, '滞涨', '滞跌'))
+
+# 仅价格异常：排除成交量异常（已被价量齐升/跌覆盖或属于放量情形）
+register_anomaly_detector(
+    'price_only', priority=30,
+    requires=['abnormal_price_only'],
+    excludes=['abnormal_volume'],
+    params=['price_only_std'],
+    text=lambda pct: reduce(np.char.add, ['[价异动] ', rise_fall_labels(pct), ' ', format_pct_text(pct)]),
+    event_type=rise_fall_labels)
+
+# 仅成交量异常：排除价格异常和价格稳定（已被前两条规则覆盖）
+register_anomaly_detector(
+    'volume_only', priority=40,
+    requires=['abnormal_volume_only'],
+    excludes=['abnormal_price', 'stable_price'],
+    params=['volume_only_std'],
+    text=lambda pct: np.full(len(pct), '[量异动]'),
+    event_type=lambda pct: np.full(len(pct), '放量'))
+
+def record_anomaly_detector_timings(timings):
+    """累计各检测器的耗时统计"""
+    with anomaly_detector_lock:
+        for name, elapsed_ms in timings.items():
+            entry = anomaly_detector_timings.setdefault(name, {'runs': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            entry['runs'] += 1
+            entry['total_ms'] += elapsed_ms
+            entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+
+def get_anomaly_detector_stats():
+    """返回已注册的检测器及其耗时统计（平均、最大、占全部检测耗时的比例）"""
+    with anomaly_detector_lock:
+        total = sum(entry['total_ms'] for entry in anomaly_detector_timings.values())
+        detectors = []
+        for name in ANOMALY_RULES:
+            detector = ANOMALY_DETECTORS[name]
+            entry = anomaly_detector_timings.get(name, {'runs': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            detectors.append({
+                'name': name,
+                'priority': detector['priority'],
+                'requires': detector['requires'],
+                'excludes': detector['excludes'],
+                'params': detector['params'],
+                'runs': entry['runs'],
+                'avg_ms': round(entry['total_ms'] / entry['runs'], 3) if entry['runs'] else None,
+                'max_ms': round(entry['max_ms'], 3),
+                'share': round(entry['total_ms'] / total, 4) if total else None
+            })
+        return detectors
 
-        # 双重检查边界
-        if start_index > max_index or end_index > max_index:
-            print(f"[ERROR] 索引越界: start={start_index}, end={end_index}, max={max_index}")
-            continue
+def evaluate_anomaly_detectors(stats, params):
+    """
+    按优先级求值全部检测器，返回 (按规则编号排列的布尔掩码列表, 各检测器耗时毫秒)
+    参数可以是标量，也可以是能与K线轴广播的数组（网格搜索时每个参数占一个维度），掩码随之广播
+    """
+    masks = {}  # 已求值的条件和检测器
+
+    def mask_of(name):
+        if name not in masks:
+            with np.errstate(invalid='ignore'):
+                masks[name] = ANOMALY_CONDITIONS[name](stats, params)
+        return masks[name]
+
+    timings = {}
+    for name in ANOMALY_RULES:
+        detector = ANOMALY_DETECTORS[name]
+        started = time.perf_counter()
+        mask = reduce(np.logical_and, [mask_of(condition) for condition in detector['requires']])
+        for excluded in detector['excludes']:
+            mask = mask & ~mask_of(excluded)
+        masks[name] = mask
+        timings[name] = (time.perf_counter() - started) * 1000
+    return [masks[name] for name in ANOMALY_RULES], timings
+
+def detect_anomaly_events(stats, price_std, volume_std, price_only_std, volume_only_std):
+    """
+    按优先级运行全部异常检测器
+    stats: 滚动统计内核的结果（提供涨跌幅和60周期动态基准），其余参数为各规则的标准差倍数
+    返回：列式字典 index/rule/pct/timestamp/close/volume，按规则编号（检测器优先级）、再按时间排序，
+    另附本次各检测器耗时 timings（毫秒）；K线数量不超过统计窗口时为空
+    """
+    timestamps = stats['timestamp']
+    close = stats['close']
+    volume = stats['volume']
+
+    if len(close) <= ANOMALY_ANALYSIS_PERIOD:
+        index = np.empty(0, dtype='int64')
+        return {
+            'index': index,
+            'rule': np.empty(0, dtype='int8'),
+            'pct': close[index],
+            'timestamp': timestamps[index],
+            'close': close[index],
+            'volume': volume[index],
+            'timings': {}
+        }
+
+    params = {
+        'price_std': price_std,
+        'volume_std': volume_std,
+        'price_only_std': price_only_std,
+        'volume_only_std': volume_only_std
+    }
+    masks, timings = evaluate_anomaly_detectors(stats, params)
+    record_anomaly_detector_timings(timings)
+    hits = [np.flatnonzero(mask) for mask in masks]
+
+    index = np.concatenate(hits)
+    rule = np.concatenate([np.full(len(hit), code, dtype='int8') for code, hit in enumerate(hits)])
+    pct = stats['price_change_pct']
+    return {
+        'index': index,
+        'rule': rule,
+        'pct': pct[index],
+        'timestamp': timestamps[index],
+        'close': close[index],
+        'volume': volume[index],
+        'timings': timings
+    }
 
-        start_date = dt.datetime.fromtimestamp(timestamps[start_index]).strftime('%Y-%m-%d')
-        end_date = dt.datetime.fromtimestamp(timestamps[end_index]).strftime('%Y-%m-%d')
+def format_anomaly_events(events, formatter):
+    """按检测器批量生成每个事件的文字（formatter为'text'或'event_type'），返回字符串列表"""
+    labels = np.empty(len(events['rule']), dtype=object)
+    for code, name in enumerate(ANOMALY_RULES):
+        selected = events['rule'] == code
+        if selected.any():
+            labels[selected] = ANOMALY_DETECTORS[name][formatter](events['pct'][selected])
+    return labels.tolist()
+
+def anomaly_event_texts(events):
+    """批量生成stock_data的算法注释文字，如 [价量齐上涨] 波动: 5.12%"""
+    return format_anomaly_events(events, 'text')
+
+def anomaly_event_types(events):
+    """批量生成analysis_data的事件类型：上涨/下跌、滞涨/滞跌、放量"""
+    return format_anomaly_events(events, 'event_type')
+
+# --- V7.6: 滚动统计内核 ---
+# stock_data / analysis_data / trend_analysis 用到的滚动统计（收盘价和成交量的5/20/25/50/60周期均线、
+# 涨跌幅及其60周期标准差、成交量60周期标准差）由一次分组滚动计算得到，以列数组结构（struct-of-arrays）返回；
+# 结果按行情序列版本缓存，同一序列只改阈值参数的后续请求直接复用
+ROLLING_WINDOWS = (5, 20, 25, 50, 60)
+
+def compute_rolling_stats(series):
+    """
+    计算行情序列的全部滚动统计
+    收盘价和成交量放在同一个DataFrame中按窗口分组滚动（每个窗口一次），数值与逐列rolling完全一致
+    返回：{'timestamp'/'close'/'volume': 原始列, 'close_ma'/'volume_ma': {窗口: 均线},
+          'price_change_pct': 涨跌幅, 'price_change_std': 涨跌幅60周期标准差, 'volume_std': 成交量60周期标准差}
+    """
+    close = np.asarray(series['close'], dtype='float64')
+    volume = np.asarray(series['volume'])
+    frame = pd.DataFrame({'close': close, 'volume': volume})
+
+    stats = {
+        'timestamp': np.asarray(series['timestamp'], dtype='int64'),
+        'close': close,
+        'volume': volume,
+        'close_ma': {},
+        'volume_ma': {}
+    }
+    for window in ROLLING_WINDOWS:
+        means = frame.rolling(window=window).mean()
+        stats['close_ma'][window] = means['close'].to_numpy()
+        stats['volume_ma'][window] = means['volume'].to_numpy()
+
+    prev_close = np.concatenate(([np.nan], close[:-1]))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct = (close - prev_close) / prev_close
+    stds = pd.DataFrame({'pct': pct, 'volume': volume}).rolling(window=ANOMALY_ANALYSIS_PERIOD).std()
+    stats['price_change_pct'] = pct
+    stats['price_change_std'] = stds['pct'].to_numpy()
+    stats['volume_std'] = stds['volume'].to_numpy()
+
+    # 缓存结果在多个请求间共享，标记为只读
+    for value in stats.values():
+        for arr in (value.values() if isinstance(value, dict) else [value]):
+            arr.flags.writeable = False
+    return stats
+
+# --- V7.7: 指标结果缓存 ---
+# 同一行情序列上的指标结果只取决于指标参数：缓存键为(序列键, 指标名, 参数...)，序列键包含ticker、周期、
+# 序列版本、长度和首尾K线时间戳，K线刷新后自动失效。各指标单独缓存，只改某个参数时其余指标直接复用
+# （如只改price_std不会重算任何ZIG）。按估算的内存占用做LRU淘汰，总量不超过INDICATOR_CACHE_MAX_MB
+INDICATOR_CACHE_MAX_MB = float(os.environ.get('INDICATOR_CACHE_MAX_MB', 128))
+indicator_cache = OrderedDict()  # 键 -> (结果, 估算字节数)
+indicator_cache_state = {'bytes': 0, 'hits': 0, 'misses': 0, 'evictions': 0}
+indicator_cache_lock = threading.Lock()
+
+def price_series_key(yahoo_ticker, interval, series):
+    """行情序列的缓存键：(ticker, 周期, 版本, 长度, 首根时间戳, 末根时间戳)"""
+    ts = series['timestamp']
+    if len(ts) == 0:
+        return (yahoo_ticker, interval, series['version'], 0, None, None)
+    return (yahoo_ticker, interval, series['version'], len(ts), int(ts[0]), int(ts[-1]))
+
+def estimate_nbytes(value):
+    """估算指标结果占用的内存（数组按nbytes，容器递归累加）"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes + 112
+    if isinstance(value, dict):
+        return 232 + sum(estimate_nbytes(k) + estimate_nbytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return 56 + 8 * len(value) + sum(estimate_nbytes(item) for item in value)
+    if isinstance(value, str):
+        return 49 + 4 * len(value)
+    return 32
+
+def cached_indicator(key, compute, *args):
+    """读取指标缓存，未命中时调用compute(*args)计算并写入缓存；超过内存上限时淘汰最久未使用的结果"""
+    with indicator_cache_lock:
+        entry = indicator_cache.get(key)
+        if entry is not None:
+            indicator_cache.move_to_end(key)
+            indicator_cache_state['hits'] += 1
+            return entry[0]
+        indicator_cache_state['misses'] += 1
+
+    value = compute(*args)
+    nbytes = estimate_nbytes(value)
+    limit = INDICATOR_CACHE_MAX_MB * 1024 * 1024
+    if nbytes > limit:
+        return value
+
+    with indicator_cache_lock:
+        previous = indicator_cache.pop(key, None)
+        if previous is not None:
+            indicator_cache_state['bytes'] -= previous[1]
+        indicator_cache[key] = (value, nbytes)
+        indicator_cache_state['bytes'] += nbytes
+        while indicator_cache_state['bytes'] > limit:
+            _, (_, evicted_bytes) = indicator_cache.popitem(last=False)
+            indicator_cache_state['bytes'] -= evicted_bytes
+            indicator_cache_state['evictions'] += 1
+    return value
+
+def get_indicator_cache_stats():
+    """返回指标缓存的条目数、估算内存占用和命中统计"""
+    with indicator_cache_lock:
+        lookups = indicator_cache_state['hits'] + indicator_cache_state['misses']
+        return {
+            'entries': len(indicator_cache),
+            'memory_mb': round(indicator_cache_state['bytes'] / 1024 / 1024, 2),
+            'max_memory_mb': INDICATOR_CACHE_MAX_MB,
+            'hits': indicator_cache_state['hits'],
+            'misses': indicator_cache_state['misses'],
+            'hit_rate': round(indicator_cache_state['hits'] / lookups, 4) if lookups else None,
+            'evictions': indicator_cache_state['evictions']
+        }
 
-        phase_type = 'Uptrend' if end_value > start_value else 'Downtrend'
+def zig_pivots_to_list(length, indices, pivot_values):
+    """把拐点数组展开成与序列等长的列表：拐点处为数值，其余为None"""
+    zig = [None] * length
+    for index, value in zip(indices.tolist(), pivot_values.tolist()):
+        zig[index] = value
+    return zig
+
+# --- V7.8: 指标注册表 ---
+# 每种指标用register_indicator声明：名称、依赖（由参数推导出的上游指标）以及计算函数。
+# 指标以元组表示：(名称, 参数...)，如 ('ma', 50)、('zig', 'ma50', 25.0)、('phases', 'ma50', 25.0)。
+# 接口列出需要的输出，evaluate_indicators只计算这些输出依赖到的指标，每个指标在一次求值中只算一次，
+# 可缓存的指标结果写入指标缓存（V7.7），命中时连同它的上游都不再计算。新增指标或检测器只需注册一个函数
+INDICATORS = {}
+
+def register_indicator(name, deps=None, cache=True):
+    """
+    注册指标的装饰器
+    deps: 由指标参数返回上游指标列表的函数，计算函数依次收到 (context, *参数, *上游结果)
+    cache: 是否写入指标缓存（直接取自其他结果的轻量指标不必缓存）
+    """
+    def decorator(compute):
+        INDICATORS[name] = {'deps': deps or (lambda *params: []), 'compute': compute, 'cache': cache}
+        return compute
+    return decorator
 
-        phases.append({
-            'start_date': start_date,
-            'end_date': end_date,
-            'phase': phase_type
-        })
-    return phases
+def new_indicator_context(yahoo_ticker, interval, series, persist_zig=False):
+    """
+    一次指标求值的上下文
+    persist_zig: ZIG是否从K线文件旁的续算状态计算（V7.4，只用于完整的缓存序列）
+    """
+    return {
+        'yahoo_ticker': yahoo_ticker,
+        'interval': interval,
+        'series': series,
+        'series_key': price_series_key(yahoo_ticker, interval, series),
+        'persist_zig': persist_zig,
+        'zig_states': None,
+        'zig_states_changed': False
+    }
+
+def evaluate_indicators(context, outputs):
+    """
+    按依赖关系计算所需的指标
+    outputs: 指标元组列表，返回{指标元组: 结果}；结果可能被缓存共享，调用方不应修改
+    """
+    results = {}
+
+    def evaluate(spec):
+        if spec in results:
+            return results[spec]
+        definition = INDICATORS.get(spec[0])
+        if definition is None:
+            raise ValueError(f"未注册的指标: {spec[0]}")
+        params = spec[1:]
+
+        def compute():
+            inputs = [evaluate(dep) for dep in definition['deps'](*params)]
+            return definition['compute'](context, *params, *inputs)
+
+        if definition['cache']:
+            results[spec] = cached_indicator((context['series_key'],) + tuple(spec), compute)
+        else:
+            results[spec] = compute()
+        return results[spec]
+
+    for spec in outputs:
+        evaluate(spec)
+    if context['zig_states_changed']:
+        save_zig_states(context['yahoo_ticker'], context['interval'], context['zig_states'])
+        context['zig_states_changed'] = False
+    return {spec: results[spec] for spec in outputs}
+
+def zig_source_spec(source):
+    """ZIG数据源名称对应的指标：close/volume为原始列，maN/volume_maN为N周期均线"""
+    if source in ('close', 'volume'):
+        return ('column', source)
+    if source.startswith('volume_ma') and source[9:].isdigit():
+        return ('volume_ma', int(source[9:]))
+    if source.startswith('ma') and source[2:].isdigit():
+        return ('ma', int(source[2:]))
+    raise ValueError(f"不支持的ZIG数据源: {source}")
+
+@register_indicator('rolling_stats')
+def indicator_rolling_stats(context):
+    """滚动统计内核（V7.6）"""
+    return compute_rolling_stats(context['series'])
+
+@register_indicator('column', cache=False)
+def indicator_column(context, name):
+    """行情序列的原始列（浮点数组）"""
+    return np.asarray(context['series'][name], dtype='float64')
+
+@register_indicator('ma', deps=lambda window: [('rolling_stats',)], cache=False)
+def indicator_ma(context, window, stats):
+    """收盘价N周期均线，常用窗口取自滚动统计内核"""
+    if window in stats['close_ma']:
+        return stats['close_ma'][window]
+    return pd.Series(stats['close']).rolling(window=window).mean().to_numpy()
+
+@register_indicator('volume_ma', deps=lambda window: [('rolling_stats',)], cache=False)
+def indicator_volume_ma(context, window, stats):
+    """成交量N周期均线，常用窗口取自滚动统计内核"""
+    if window in stats['volume_ma']:
+        return stats['volume_ma'][window]
+    return pd.Series(stats['volume']).rolling(window=window).mean().to_numpy()
+
+@register_indicator('price_change_pct', deps=lambda: [('rolling_stats',)], cache=False)
+def indicator_price_change_pct(context, stats):
+    """相对前一根K线的涨跌幅"""
+    return stats['price_change_pct']
+
+@register_indicator('zig', deps=lambda source, threshold: [zig_source_spec(source)])
+def indicator_zig(context, source, threshold, values):
+    """ZIG拐点：(拐点下标数组, 拐点数值数组)；persist_zig时从持久化状态续算"""
+    if not context['persist_zig']:
+        return calculate_zig_pivots(values, threshold)
+    if context['zig_states'] is None:
+        context['zig_states'] = load_zig_states(context['yahoo_ticker'], context['interval'])
+    key = f"{source}:{threshold:g}"
+    indices, pivot_values, record = resume_zig_pivots(values, threshold, context['series'], context['zig_states'].get(key))
+    if record is not None and record is not context['zig_states'].get(key):
+        context['zig_states'][key] = record
+        context['zig_states_changed'] = True
+    return indices, pivot_values
+
+@register_indicator('dates')
+def indicator_dates(context):
+    """每根K线的本地日期字符串（YYYY-MM-DD），按序列版本缓存，区间划分和各接口按下标取用"""
+    dates = format_local_dates(context['series']['timestamp'])
+    dates.flags.writeable = False
+    return dates
+
+@register_indicator('phases', deps=lambda source, threshold: [('zig', source, threshold), ('dates',)])
+def indicator_phases(context, source, threshold, pivots, dates):
+    """由ZIG拐点划分的上涨/下跌区间"""
+    return calculate_phases_from_pivots(*pivots, dates)
+
+@register_indicator('anomalies', deps=lambda *multipliers: [('rolling_stats',), ('dates',)])
+def indicator_anomalies(context, price_std, volume_std, price_only_std, volume_only_std, stats, dates):
+    """异常检测器的检测结果（V7.5），附带事件日期（'date'列）"""
+    events = detect_anomaly_events(stats, price_std, volume_std, price_only_std, volume_only_std)
+    events['date'] = dates[events['index']]
+    return events
 
 
 @app.route('/')
@@ -1654,7 +3058,7 @@ def dify_proxy_api():
         
         # 第二步：调用工作流，使用600秒超时
         try:
-            workflow_response = requests.post(
+            workflow_response = http_post(
                 'https://work.pgi.chat/v1/workflows/run',
                 headers={
                     'Authorization': f'Bearer {dify_token}',
@@ -1816,7 +3220,7 @@ def background_ai_analysis(task_id, annotation_id, input_text, ticker, date, ai_
                 ai_tasks[task_id]['updated_at'] = dt.datetime.now()
 
         try:
-            workflow_response = requests.post(
+            workflow_response = http_post(
                 'https://work.pgi.chat/v1/workflows/run',
                 headers={
                     'Authorization': f'Bearer {dify_token}',
@@ -1857,7 +3261,7 @@ def background_ai_analysis(task_id, annotation_id, input_text, ticker, date, ai_
 
                         try:
                             # 使用相同参数但更短超时重试
-                            retry_response = requests.post(
+                            retry_response = http_post(
                                 'https://work.pgi.chat/v1/workflows/run',
                                 headers={
                                     'Authorization': f'Bearer {dify_token}',
@@ -2454,10 +3858,23 @@ def export_annotations():
 @app.route('/api/stock_data')
 @require_api_auth
 def stock_data():
+    payload, status_code = build_stock_data(request.args)
+    if status_code == 200:
+        record_ticker_request(payload['ticker'])  # V6.9
+    headers = {'Retry-After': str(payload['retry_after'])} if 'retry_after' in payload else {}
+    return jsonify(payload), status_code, headers
+
+def build_stock_data(args, history=None):
+    """
+    V6.7: stock_data的计算主体，单只和批量接口共用
+    args: 与/api/stock_data查询参数相同的键值（支持.get）
+    history: 已预取的get_price_series结果，为None时在此读取
+    返回：(响应字典, HTTP状态码)
+    """
     import datetime as dt
     # --- 获取前端参数 ---
-    user_input_ticker = request.args.get('ticker', 'AAPL')
-    period_param = request.args.get('period', '1d')
+    user_input_ticker = args.get('ticker', 'AAPL')
+    period_param = args.get('period', '1d')
     
     # --- 智能股票代码识别与转换 ---
     print(f"[API] 用户输入: {user_input_ticker}")
@@ -2467,7 +3884,7 @@ def stock_data():
     
     if not normalized_ticker:
         smart_error_msg = generate_smart_error_message(user_input_ticker, identification_type)
-        return jsonify({'error': smart_error_msg}), 400
+        return {'error': smart_error_msg}, 400
     
     print(f"[API] 标准化结果: {user_input_ticker} -> {normalized_ticker} (类型: {identification_type})")
     
@@ -2479,22 +3896,22 @@ def stock_data():
     print(f"[API] 最终使用 - 内部格式: {ticker}, Yahoo格式: {yahoo_ticker}")
     
     # V1.2 & V1.8 新增：从前端获取算法参数，并提供默认值
-    price_std_multiplier = float(request.args.get('price_std', 1.8))
-    volume_std_multiplier = float(request.args.get('volume_std', 1.8))
-    price_only_std_multiplier = float(request.args.get('price_only_std', 2.5))
-    volume_only_std_multiplier = float(request.args.get('volume_only_std', 3.0)) # 新增：仅成交量异常的倍数
+    price_std_multiplier = float(args.get('price_std', 1.8))
+    volume_std_multiplier = float(args.get('volume_std', 1.8))
+    price_only_std_multiplier = float(args.get('price_only_std', 2.5))
+    volume_only_std_multiplier = float(args.get('volume_only_std', 3.0)) # 新增：仅成交量异常的倍数
 
     # ZIG指标参数
-    short_term_zig_threshold = float(request.args.get('short_term_zig', 10))
-    medium_term_zig_threshold = float(request.args.get('medium_term_zig', 10))
-    long_term_zig_threshold = float(request.args.get('long_term_zig', 25))
-    zig_phase_source = request.args.get('zig_phase_source', 'zig50') # 新增：用于判断区间的ZIG来源
+    short_term_zig_threshold = float(args.get('short_term_zig', 10))
+    medium_term_zig_threshold = float(args.get('medium_term_zig', 10))
+    long_term_zig_threshold = float(args.get('long_term_zig', 25))
+    zig_phase_source = args.get('zig_phase_source', 'zig50') # 新增：用于判断区间的ZIG来源
 
     # V2.0 新增: 成交量ZIG指标参数
-    volume_short_term_zig_threshold = float(request.args.get('volume_short_term_zig', 10))
-    volume_medium_term_zig_threshold = float(request.args.get('volume_medium_term_zig', 10))
-    volume_long_term_zig_threshold = float(request.args.get('volume_long_term_zig', 10))
-    volume_zig_phase_source = request.args.get('volume_zig_phase_source', 'volume_zig50')
+    volume_short_term_zig_threshold = float(args.get('volume_short_term_zig', 10))
+    volume_medium_term_zig_threshold = float(args.get('volume_medium_term_zig', 10))
+    volume_long_term_zig_threshold = float(args.get('volume_long_term_zig', 10))
+    volume_zig_phase_source = args.get('volume_zig_phase_source', 'volume_zig50')
 
     print(f"获取股票数据: {ticker}, 周期: {period_param}")
     print(f"算法参数: price_std={price_std_multiplier}, volume_std={volume_std_multiplier}, price_only_std={price_only_std_multiplier}, volume_only_std={volume_only_std_multiplier}")
@@ -2505,16 +3922,6 @@ def stock_data():
     company_name = get_company_name(ticker)
 
 
-    # 根据K线周期设置合适的时间范围
-    # 使用明确的起止日期而不是range=max，以避免Yahoo Finance API的已知bug
-    # (使用range=max可能会返回错误的数据粒度，如请求日线却返回周线数据)
-    end_date = dt.datetime.now()
-    start_date = end_date - dt.timedelta(days=365*20)  # 最多获取20年历史数据
-
-    # 将日期转换为Unix时间戳
-    period1 = int(start_date.timestamp())
-    period2 = int(end_date.timestamp())
-
     if period_param == '1mo':
         interval_param = '1mo'
     elif period_param == '1wk':
@@ -2522,62 +3929,38 @@ def stock_data():
     else:
         interval_param = '1d'
 
-    url = f"https://query1.finance.yahoo.com/v8/finance/chart/{yahoo_ticker}?period1={period1}&period2={period2}&interval={interval_param}"
-    print(f"请求Yahoo Finance API: {url}")
     print(f"[API] 使用Yahoo格式: {yahoo_ticker} (原始输入: {user_input_ticker})")
 
     try:
-        response = requests.get(url, headers=HEADERS, timeout=10)
-        response.raise_for_status()
+        # V6.0: 从K线缓存读取20年历史，缓存过期时才请求Yahoo
+        if history is None:
+            history = get_price_series(yahoo_ticker, interval_param)
+        series, error_type, error_detail = history
 
-        # 安全地解析JSON响应
-        try:
-            yahoo_data = response.json()
-        except ValueError as e:
-            # 响应不是有效的JSON（如"Too Many Requests"文本）
-            error_text = response.text[:200] if response.text else "无响应内容"
-            print(f"[ERROR] Yahoo Finance API返回非JSON响应: {error_text}")
-            return jsonify({
+        if error_type == 'invalid_response':
+            return {
                 'error': 'Yahoo Finance API暂时不可用，请等待3-5分钟后重试',
-                'details': f'API返回: {error_text}',
+                'details': f'API返回: {error_detail}',
                 'suggestion': '这通常是由于请求频率过高导致的临时限制'
-            }), 503
-
-        result = yahoo_data.get('chart', {}).get('result', [])
-        if not result:
-            return jsonify({'error': f"无法从雅虎财经获取股票代码为 '{ticker}' 的数据，请检查股票代码是否正确。"}), 404
-
-        res = result[0]
-        timestamps = res.get('timestamp', [])
-
-        # 安全地获取quote数据，避免list index out of range
-        indicators = res.get('indicators', {})
-        quote_list = indicators.get('quote', [])
-
-        if not quote_list:
-            print(f"[ERROR] Yahoo Finance返回的数据中没有quote信息")
-            return jsonify({
+            }, 503
+        if error_type == 'rate_limited':
+            return {
+                'error': 'Yahoo Finance请求频率受限，请稍后重试',
+                'details': f'预计 {error_detail} 秒后恢复',
+                'retry_after': error_detail
+            }, 503
+        if error_type == 'not_found':
+            return {'error': f"无法从雅虎财经获取股票代码为 '{ticker}' 的数据，请检查股票代码是否正确。"}, 404
+        if error_type == 'no_quote':
+            return {
                 'error': f"无法解析 '{ticker}' 的股价数据",
                 'details': 'Yahoo Finance返回的数据格式不完整'
-            }), 500
-
-        ohlc = quote_list[0]
-
-        if not timestamps or not ohlc.get('open'):
-             return jsonify({'error': f"返回的数据格式不完整，无法解析 '{ticker}' 的股价。"}), 500
-        
-        # 使用Pandas DataFrame进行数据分析
-        df = pd.DataFrame({
-            'timestamp': timestamps,
-            'open': ohlc['open'],
-            'high': ohlc['high'],
-            'low': ohlc['low'],
-            'close': ohlc['close'],
-            'volume': ohlc['volume']
-        })
+            }, 500
+        if series is None:
+            return {'error': f"返回的数据格式不完整，无法解析 '{ticker}' 的股价。"}, 500
 
-        # 移除空值行，并使用 .copy() 避免 SettingWithCopyWarning
-        df = df.dropna().copy()
+        # V7.0: 由只读行情序列构造本次请求使用的DataFrame
+        df = price_series_to_frame(series)
 
         # 初始化分析结果容器
         generated_annotations = []
@@ -2624,168 +4007,75 @@ def stock_data():
         manual_annotations = [anno for anno in existing_annotations if anno['type'] == 'manual']
         existing_algorithm_annotations = [anno for anno in existing_annotations if anno['type'] in ['algorithm', 'price_volume', 'volume_stable_price', 'price_only', 'volume_only', 'ai_analysis']]
 
-        # --- V1.2: 可配置的动态阈值异常检测 ---
-        analysis_period = 60  # 使用60个周期作为统计窗口
-        
-        if len(df) > analysis_period:
-            # 1. 计算价格和成交量的动态基准
-            df['prev_close'] = df['close'].shift(1)
-            df['price_change_pct'] = (df['close'] - df['prev_close']) / df['prev_close']
-            
-            df['price_change_std'] = df['price_change_pct'].rolling(window=analysis_period).std()
-            df['volume_mean'] = df['volume'].rolling(window=analysis_period).mean()
-            df['volume_std'] = df['volume'].rolling(window=analysis_period).std()
-
-            # 2. 定义异常条件
-            # 价量齐升的异常价格
-            is_abnormal_price_for_volume = df['price_change_pct'].abs() > (df['price_change_std'] * price_std_multiplier)
-            # 单独的价格异常
-            is_abnormal_price_only = df['price_change_pct'].abs() > (df['price_change_std'] * price_only_std_multiplier)
-            # 成交量异常
-            is_abnormal_volume = df['volume'] > (df['volume_mean'] + df['volume_std'] * volume_std_multiplier)
-            # 价格稳定
-            is_stable_price = df['price_change_pct'].abs() < 0.01
-
-            # 3. 应用规则并生成标注
-            # 规则一：价量齐升/跌
-            abnormal_price_volume_days = df[is_abnormal_price_for_volume & is_abnormal_volume]
-            for _, row in abnormal_price_volume_days.iterrows():
-                change_type = "上涨" if row['price_change_pct'] > 0 else "下跌"
-                date_str = dt.datetime.fromtimestamp(row['timestamp']).strftime('%Y-%m-%d')
-                text = f'[价量齐{change_type}] 波动: {row["price_change_pct"]:.2%}'
-                
-                # 保存到数据库并获取注释信息
-                annotation_result = save_algorithm_annotation(
-                    ticker, date_str, text, 'price_volume',
-                    {'price_std': price_std_multiplier, 'volume_std': volume_std_multiplier}
-                )
-                
-                if annotation_result:
-                    # 使用数据库中的实际内容（可能已被用户编辑）
-                    generated_annotations.append({
-                        'date': date_str,
-                        'text': annotation_result['text'],
-                        'type': 'price_volume',
-                        'id': annotation_result['id'],
-                        'is_favorite': annotation_result.get('is_favorite', False)
-                    })
-
-            # 规则二：放量滞涨/跌 (成交量异常但价格稳定)
-            abnormal_volume_stable_price_days = df[is_abnormal_volume & is_stable_price]
-            for _, row in abnormal_volume_stable_price_days.iterrows():
-                change_type = "上涨" if row['price_change_pct'] > 0 else ("下跌" if row['price_change_pct'] < 0 else "平盘")
-                date_str = dt.datetime.fromtimestamp(row['timestamp']).strftime('%Y-%m-%d')
-                text = f'[放量滞{change_type}] 波动: {row["price_change_pct"]:.2%}'
-                
-                # 保存到数据库并获取注释信息
-                annotation_result = save_algorithm_annotation(
-                    ticker, date_str, text, 'volume_stable_price',
-                    {'volume_std': volume_std_multiplier}
-                )
-                
-                if annotation_result:
-                    # 使用数据库中的实际内容（可能已被用户编辑）
-                    generated_annotations.append({
-                        'date': date_str,
-                        'text': annotation_result['text'],
-                        'type': 'volume_stable_price',
-                        'id': annotation_result['id'],
-                        'is_favorite': annotation_result.get('is_favorite', False)
-                    })
-            
-            # 规则三：仅价格异常 (成交量未显著放大)
-            # 我们要排除掉已经被规则一覆盖的情况
-            price_only_days = df[is_abnormal_price_only & ~is_abnormal_volume]
-            for _, row in price_only_days.iterrows():
-                change_type = "上涨" if row['price_change_pct'] > 0 else "下跌"
-                date_str = dt.datetime.fromtimestamp(row['timestamp']).strftime('%Y-%m-%d')
-                text = f'[价异动] {change_type} {row["price_change_pct"]:.2%}'
-                
-                # 保存到数据库并获取注释信息
-                annotation_result = save_algorithm_annotation(
-                    ticker, date_str, text, 'price_only',
-                    {'price_only_std': price_only_std_multiplier}
-                )
-                
-                if annotation_result:
-                    # 使用数据库中的实际内容（可能已被用户编辑）
-                    generated_annotations.append({
-                        'date': date_str,
-                        'text': annotation_result['text'],
-                        'type': 'price_only',
-                        'id': annotation_result['id'],
-                        'is_favorite': annotation_result.get('is_favorite', False)
-                    })
+        # V7.8: 列出本次需要的指标，由注册表按依赖关系计算（均线取自滚动统计内核，结果按参数缓存）
+        zig_specs = {
+            # 价格ZIG
+            'zig5': ('zig', 'ma5', short_term_zig_threshold),
+            'zig25': ('zig', 'ma25', medium_term_zig_threshold),
+            'zig50': ('zig', 'ma50', long_term_zig_threshold),
+            # 成交量ZIG
+            'volume_zig5': ('zig', 'volume_ma5', volume_short_term_zig_threshold),
+            'volume_zig25': ('zig', 'volume_ma25', volume_medium_term_zig_threshold),
+            'volume_zig50': ('zig', 'volume_ma50', volume_long_term_zig_threshold)
+        }
+        # V1.9: 基于ZIG指标判断市场阶段（默认使用zig50）；V2.0: 基于成交量ZIG判断放量/缩量阶段（默认使用volume_zig50）
+        phase_zig = zig_specs[zig_phase_source if zig_phase_source in ('zig5', 'zig25', 'zig50') else 'zig50']
+        volume_phase_zig = zig_specs[volume_zig_phase_source if volume_zig_phase_source in ('volume_zig5', 'volume_zig25', 'volume_zig50') else 'volume_zig50']
+        phase_spec = ('phases',) + phase_zig[1:]
+        volume_phase_spec = ('phases',) + volume_phase_zig[1:]
+        anomaly_spec = ('anomalies', price_std_multiplier, volume_std_multiplier, price_only_std_multiplier, volume_only_std_multiplier)
+        ma_specs = {
+            'ma5': ('ma', 5), 'ma25': ('ma', 25), 'ma50': ('ma', 50),
+            'ma5_new': ('ma', 5), 'ma20': ('ma', 20), 'ma60_new': ('ma', 60),  # 常用均线：5日线、20日线、60日线
+            'volume_ma5': ('volume_ma', 5), 'volume_ma25': ('volume_ma', 25), 'volume_ma50': ('volume_ma', 50)
+        }
+        indicators = evaluate_indicators(
+            new_indicator_context(yahoo_ticker, interval_param, series, persist_zig=True),
+            [anomaly_spec, ('price_change_pct',), ('dates',), phase_spec, volume_phase_spec]
+            + list(zig_specs.values()) + list(ma_specs.values()))
 
-            # 规则四：仅成交量异常 (价格未显著波动)
-            # V1.8 新增：当成交量异常，但价格波动不显著时
-            is_abnormal_volume_only = df['volume'] > (df['volume_mean'] + df['volume_std'] * volume_only_std_multiplier)
-            # 排除掉已经被规则一和规则二覆盖的情况
-            volume_only_days = df[is_abnormal_volume_only & ~is_abnormal_price_for_volume & ~is_stable_price]
-            for _, row in volume_only_days.iterrows():
-                date_str = dt.datetime.fromtimestamp(row['timestamp']).strftime('%Y-%m-%d')
-                text = f'[量异动]'
-                
-                # 保存到数据库并获取注释信息
-                annotation_result = save_algorithm_annotation(
-                    ticker, date_str, text, 'volume_only',
-                    {'volume_only_std': volume_only_std_multiplier}
-                )
-                
-                if annotation_result:
-                    # 使用数据库中的实际内容（可能已被用户编辑）
-                    generated_annotations.append({
-                        'date': date_str,
-                        'text': annotation_result['text'],
-                        'type': 'volume_only',
-                        'id': annotation_result['id'],
-                        'is_favorite': annotation_result.get('is_favorite', False)
-                    })
+        # --- V1.2: 可配置的动态阈值异常检测（V7.5: 四条规则向量化求值；V7.9: 检测器插件） ---
+        events = indicators[anomaly_spec]
+        if len(df) > ANOMALY_ANALYSIS_PERIOD:
+            df['price_change_pct'] = indicators[('price_change_pct',)]
 
-        # --- ZIG指标均线计算 ---
-        # 价格均线
-        df['ma5'] = df['close'].rolling(window=5).mean()
-        df['ma25'] = df['close'].rolling(window=25).mean()
-        df['ma50'] = df['close'].rolling(window=50).mean()
-        
-        # --- 新增：常用均线计算 ---
-        df['ma5_new'] = df['close'].rolling(window=5).mean()  # 5日线
-        df['ma20'] = df['close'].rolling(window=20).mean()    # 20日线  
-        df['ma60_new'] = df['close'].rolling(window=60).mean() # 60日线
-
-        # 成交量均线
-        df['volume_ma5'] = df['volume'].rolling(window=5).mean()
-        df['volume_ma25'] = df['volume'].rolling(window=25).mean()
-        df['volume_ma50'] = df['volume'].rolling(window=50).mean()
-
-        # 计算ZIG指标
-        # 价格ZIG
-        zig5 = calculate_zig(df['ma5'], short_term_zig_threshold)
-        zig25 = calculate_zig(df['ma25'], medium_term_zig_threshold)
-        zig50 = calculate_zig(df['ma50'], long_term_zig_threshold)
-        
-        # 成交量ZIG
-        volume_zig5 = calculate_zig(df['volume_ma5'], volume_short_term_zig_threshold)
-        volume_zig25 = calculate_zig(df['volume_ma25'], volume_medium_term_zig_threshold)
-        volume_zig50 = calculate_zig(df['volume_ma50'], volume_long_term_zig_threshold)
-
-        # --- V1.9: 基于ZIG指标判断市场阶段 ---
-        zig_map = {
-            'zig5': zig5,
-            'zig25': zig25,
-            'zig50': zig50
+        detector_params = {
+            'price_std': price_std_multiplier,
+            'volume_std': volume_std_multiplier,
+            'price_only_std': price_only_std_multiplier,
+            'volume_only_std': volume_only_std_multiplier
         }
-        selected_zig = zig_map.get(zig_phase_source, zig50) # 默认使用zig50
-        market_phases = calculate_phases_from_zig(selected_zig, df['timestamp'].tolist())
+        annotation_rows = []
+        for date_str, text, code in zip(events['date'].tolist(), anomaly_event_texts(events), events['rule'].tolist()):
+            algorithm_type = ANOMALY_RULES[code]
+            algorithm_params = {name: detector_params[name] for name in ANOMALY_DETECTORS[algorithm_type]['params']}
+            annotation_rows.append((date_str, text, algorithm_type, algorithm_params))
+
+        # V8.4: 一次事务批量保存到数据库并获取注释信息
+        annotation_results = save_algorithm_annotations(ticker, annotation_rows)
+        for (date_str, _, algorithm_type, _), annotation_result in zip(annotation_rows, annotation_results):
+            if annotation_result:
+                # 使用数据库中的实际内容（可能已被用户编辑）
+                generated_annotations.append({
+                    'date': date_str,
+                    'text': annotation_result['text'],
+                    'type': algorithm_type,
+                    'id': annotation_result['id'],
+                    'is_favorite': annotation_result.get('is_favorite', False)
+                })
 
-        # V2.0: 基于成交量ZIG判断放量/缩量阶段
-        volume_zig_map = {
-            'volume_zig5': volume_zig5,
-            'volume_zig25': volume_zig25,
-            'volume_zig50': volume_zig50
-        }
-        selected_volume_zig = volume_zig_map.get(volume_zig_phase_source, volume_zig50)
-        volume_phases = calculate_phases_from_zig(selected_volume_zig, df['timestamp'].tolist())
+        # --- 价格均线、常用均线和成交量均线 ---
+        for column, spec in ma_specs.items():
+            df[column] = indicators[spec]
+
+        # --- ZIG指标（V7.4: 从K线文件旁保存的状态续算，只处理新增K线） ---
+        zig5, zig25, zig50, volume_zig5, volume_zig25, volume_zig50 = [
+            zig_pivots_to_list(len(df), *indicators[spec]) for spec in zig_specs.values()
+        ]
+
+        # 区间划分结果可能被缓存共享，复制后再返回
+        market_phases = [dict(phase) for phase in indicators[phase_spec]]
+        volume_phases = [dict(phase) for phase in indicators[volume_phase_spec]]
 
         # V1.4 修复：将NaN替换为0，确保JSON有效
         if 'price_change_pct' not in df.columns:
@@ -2795,17 +4085,16 @@ def stock_data():
         # 将整个DataFrame中的NaN替换为None，以便进行正确的JSON转换
         df.replace({np.nan: None}, inplace=True)
 
-        k_data = []
-        for index, row in df.iterrows():
-            k_data.append([
-                dt.datetime.fromtimestamp(row['timestamp']).strftime('%Y-%m-%d'),
-                row['open'],
-                row['close'],
-                row['low'],
-                row['high'],
-                row['volume'],
-                row['price_change_pct'] * 100 if row['price_change_pct'] is not None else None
-            ])
+        # V8.2: 按列批量转换，日期取自按序列缓存的日期数组
+        k_data = [list(row) for row in zip(
+            indicators[('dates',)].tolist(),
+            df['open'].tolist(),
+            df['close'].tolist(),
+            df['low'].tolist(),
+            df['high'].tolist(),
+            df['volume'].tolist(),
+            (df['price_change_pct'] * 100).tolist()
+        )]
         
         # V3.7: 合并所有注释 - 优先使用数据库中的注释，避免重复
         all_annotations = manual_annotations + existing_algorithm_annotations + generated_annotations
@@ -2870,7 +4159,7 @@ def stock_data():
         ma20_data = [None if pd.isna(x) else x for x in df['ma20']]
         ma60_new_data = [None if pd.isna(x) else x for x in df['ma60_new']]
 
-        return jsonify({
+        return {
             'ticker': ticker,
             'company_name': company_name,
             'data': k_data,
@@ -2892,42 +4181,404 @@ def stock_data():
             'ma5_new': ma5_new_data,
             'ma20': ma20_data,
             'ma60_new': ma60_new_data
-        })
+        }, 200
 
     except requests.exceptions.HTTPError as http_err:
         print(f"[ERROR] Yahoo Finance HTTPError: {http_err}")
-        return jsonify({'error': f"请求雅虎财经API时出错: {http_err}"}), 502
+        return {'error': f"请求雅虎财经API时出错: {http_err}"}, 502
     except Exception as e:
         import traceback
         print(f"[ERROR] stock_data异常: {str(e)}")
         traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
+        return {'error': str(e)}, 500
 
-# --- V3.3: 新增结构化分析数据API ---
-@app.route('/api/analysis_data')
+# --- V6.7: 多股票批量行情API ---
+BULK_FETCH_WORKERS = int(os.environ.get('BULK_FETCH_WORKERS', 8))  # 并发预取K线的线程数
+BULK_MAX_TICKERS = 100  # 单次批量请求的股票数量上限
+
+def prefetch_stock_history(user_input_ticker, period_param):
+    """预取单只股票的K线历史和公司名称（网络部分），返回get_price_series的结果；代码无法识别时返回None"""
+    normalized_ticker, _ = normalize_ticker(user_input_ticker)
+    if not normalized_ticker:
+        return None
+    get_company_name(normalized_ticker)
+    interval = period_param if period_param in ('1wk', '1mo') else '1d'
+    return get_price_series(to_yahoo_format(normalized_ticker), interval)
+
+@app.route('/api/stock_data/bulk', methods=['POST'])
 @require_api_auth
-def analysis_data():
+def stock_data_bulk():
     """
-    提供结构化的股价分析数据API
-    支持所有异常检测和ZIG指标参数的完整配置
+    批量获取多只股票的图表数据
+    请求体：{"tickers": [...], "period": "1d", 以及与/api/stock_data相同的算法参数}
+    先用有界线程池并发预取K线（已缓存的直接命中），再逐只计算并写入算法注释；
+    单只股票失败不影响其他股票，results以输入的股票代码为键
     """
-    import json
-    import datetime as dt
-    
-    # --- 获取所有参数 ---
-    user_input_ticker = request.args.get('ticker', 'ONC')
-    period_param = request.args.get('period', '1d')
-    
-    # --- 智能股票代码识别与转换 ---
-    print(f"[ANALYSIS_API] 用户输入: {user_input_ticker}")
-    
-    # Step 1: 将用户输入标准化为内部格式
-    normalized_ticker, identification_type = normalize_ticker(user_input_ticker)
-    
-    if not normalized_ticker:
-        smart_error_msg = generate_smart_error_message(user_input_ticker, identification_type)
-        return jsonify({'error': smart_error_msg}), 400
-    
+    data = request.get_json(silent=True) or {}
+    tickers = data.get('tickers')
+    if not isinstance(tickers, list) or not tickers:
+        return jsonify({'error': 'tickers必须是非空列表'}), 400
+
+    # 去重并保持顺序
+    tickers = list(dict.fromkeys(str(t).strip() for t in tickers if str(t).strip()))
+    if len(tickers) > BULK_MAX_TICKERS:
+        return jsonify({'error': f'单次最多请求 {BULK_MAX_TICKERS} 只股票'}), 400
+
+    shared_args = {k: v for k, v in data.items() if k != 'tickers'}
+    period_param = shared_args.get('period', '1d')
+    print(f"[BULK] 批量获取 {len(tickers)} 只股票，周期: {period_param}")
+
+    start_time = time.time()
+    histories = {}
+    fetch_errors = {}
+    with ThreadPoolExecutor(max_workers=min(BULK_FETCH_WORKERS, len(tickers))) as executor:
+        futures = {executor.submit(prefetch_stock_history, t, period_param): t for t in tickers}
+        for future in as_completed(futures):
+            t = futures[future]
+            try:
+                histories[t] = future.result()
+            except Exception as e:
+                print(f"[BULK] 预取失败: {t} ({e})")
+                fetch_errors[t] = str(e)
+    fetch_elapsed = time.time() - start_time
+
+    results = {}
+    for t in tickers:
+        if t in fetch_errors:
+            results[t] = {'success': False, 'status': 502, 'error': f"请求雅虎财经API时出错: {fetch_errors[t]}"}
+            continue
+        try:
+            payload, status_code = build_stock_data(dict(shared_args, ticker=t), histories.get(t))
+        except Exception as e:
+            payload, status_code = {'error': str(e)}, 500
+        if status_code == 200:
+            record_ticker_request(payload['ticker'])  # V6.9
+            results[t] = {'success': True, 'status': 200, 'data': payload}
+        else:
+            results[t] = dict(payload, success=False, status=status_code)
+
+    total_elapsed = time.time() - start_time
+    succeeded = sum(1 for r in results.values() if r['success'])
+    print(f"[BULK] 完成: {succeeded}/{len(tickers)} 成功，预取 {fetch_elapsed:.2f}s，总计 {total_elapsed:.2f}s")
+
+    return jsonify({
+        'success': True,
+        'period': period_param,
+        'count': len(tickers),
+        'succeeded': succeeded,
+        'elapsed': {'fetch': round(fetch_elapsed, 3), 'total': round(total_elapsed, 3)},
+        'results': results
+    })
+
+# --- V6.9: 收盘后预取与预热 ---
+# 各交易所收盘后刷新关注列表和访问最多的股票的K线缓存，并按默认参数预先计算指标和算法注释，
+# 使第二天第一次访问热门股票时直接命中缓存，而不是冷启动下载20年历史
+PREFETCH_ENABLED = os.environ.get('PREFETCH_ENABLED', 'false').lower() == 'true'
+PREFETCH_WATCHLIST = [t.strip() for t in os.environ.get('PREFETCH_WATCHLIST', '').split(',') if t.strip()]
+PREFETCH_TOP_N = int(os.environ.get('PREFETCH_TOP_N', 20))  # 额外预取访问次数最多的N只股票
+PREFETCH_WORKERS = int(os.environ.get('PREFETCH_WORKERS', 4))  # 并发刷新K线的线程数
+PREFETCH_DELAY_MINUTES = int(os.environ.get('PREFETCH_DELAY_MINUTES', 30))  # 收盘后延迟多久开始预取
+PREFETCH_RATE_WAIT = 120  # 预取时为Yahoo限流排队等待的最长秒数（后台任务可以多等）
+PREFETCH_CHECK_INTERVAL = 60  # 调度线程的检查间隔（秒）
+# 预取时续算的ZIG：与 /api/stock_data 日线默认阈值一致（价格 5/25/50 日均线，成交量 5/25/50 日均量）
+PREFETCH_ZIG_SPECS = [
+    ('zig', 'ma5', 10.0), ('zig', 'ma25', 10.0), ('zig', 'ma50', 25.0),
+    ('zig', 'volume_ma5', 10.0), ('zig', 'volume_ma25', 10.0), ('zig', 'volume_ma50', 10.0)
+]
+TICKER_STATS_FLUSH_INTERVAL = 60  # 访问次数写入数据库的间隔（秒）
+
+# 各市场收盘时间（交易所当地时区, 时, 分）
+MARKET_CLOSE_TIMES = {
+    'CN': ('Asia/Shanghai', 15, 0),
+    'HK': ('Asia/Hong_Kong', 16, 0),
+    'US': ('America/New_York', 16, 0)
+}
+
+ticker_request_counts = {}
+ticker_request_state = {'flushed_at': time.time()}
+ticker_request_lock = threading.Lock()
+
+prefetch_state = {'running': False, 'last_runs': {}, 'reports': {}, 'scheduler_started': False}
+prefetch_lock = threading.Lock()
+prefetch_lock_file = None  # 持有文件锁的句柄，多个worker中只有持有者执行定时预取
+
+def market_of_ticker(ticker):
+    """根据Yahoo格式代码判断所属市场：CN / HK / US"""
+    yahoo_ticker = to_yahoo_format(ticker).upper()
+    if yahoo_ticker.endswith(('.SS', '.SZ')):
+        return 'CN'
+    if yahoo_ticker.endswith('.HK'):
+        return 'HK'
+    return 'US'
+
+def record_ticker_request(ticker):
+    """记录一次股票访问（先在内存中累计，每隔一段时间批量写入数据库）"""
+    with ticker_request_lock:
+        ticker_request_counts[ticker] = ticker_request_counts.get(ticker, 0) + 1
+        due = time.time() - ticker_request_state['flushed_at'] >= TICKER_STATS_FLUSH_INTERVAL
+    if due:
+        flush_ticker_request_stats()
+
+def flush_ticker_request_stats():
+    """把内存中累计的访问次数写入ticker_request_stats表"""
+    with ticker_request_lock:
+        pending = dict(ticker_request_counts)
+        ticker_request_counts.clear()
+        ticker_request_state['flushed_at'] = time.time()
+    if not pending:
+        return
+    try:
+        db = get_db()
+        cursor = db.cursor()
+        for ticker, count in pending.items():
+            db_execute(cursor, """
+                INSERT INTO ticker_request_stats (ticker, request_count, last_requested_at)
+                VALUES (%s, %s, CURRENT_TIMESTAMP)
+                ON CONFLICT (ticker) DO UPDATE SET
+                    request_count = ticker_request_stats.request_count + excluded.request_count,
+                    last_requested_at = CURRENT_TIMESTAMP
+            """, (ticker, count))
+        db.commit()
+        cursor.close()
+        db.close()
+    except Exception as e:
+        print(f"[ERROR] 写入股票访问统计失败: {e}")
+
+def get_top_requested_tickers(limit):
+    """返回访问次数最多的股票代码"""
+    if limit <= 0:
+        return []
+    flush_ticker_request_stats()
+    try:
+        db = get_db()
+        cursor = db.cursor()
+        db_execute(cursor, """
+            SELECT ticker FROM ticker_request_stats
+            ORDER BY request_count DESC, last_requested_at DESC
+            LIMIT %s
+        """, (limit,))
+        rows = cursor.fetchall()
+        cursor.close()
+        db.close()
+        return [row['ticker'] for row in rows]
+    except Exception as e:
+        print(f"[ERROR] 读取股票访问统计失败: {e}")
+        return []
+
+def prefetch_ticker_bars(ticker):
+    """预取单只股票的K线和公司名称，返回该股票的报告（含各步骤耗时）"""
+    report = {'ticker': ticker, 'market': market_of_ticker(ticker), 'success': True, 'steps': {}}
+    step_start = time.time()
+    series, error_type, error_detail = get_price_series(to_yahoo_format(ticker), '1d',
+                                                        force_refresh=True, max_wait=PREFETCH_RATE_WAIT)
+    report['steps']['bars'] = round(time.time() - step_start, 3)
+    if series is None:
+        report['success'] = False
+        report['error'] = error_type
+        return report
+    report['bars'] = len(series['timestamp'])
+
+    step_start = time.time()
+    get_company_name(ticker)
+    report['steps']['company_name'] = round(time.time() - step_start, 3)
+    return report
+
+def prefetch_ticker_zig(ticker):
+    """
+    按默认阈值续算单只股票的日线ZIG，并把状态写入 <ticker>.zig.json
+    只生成各worker共享的磁盘产物，不写算法注释（注释在用户首次查看时生成）
+    """
+    yahoo_ticker = to_yahoo_format(ticker)
+    series, error_type, _ = get_price_series(yahoo_ticker, '1d')
+    if series is None:
+        raise RuntimeError(error_type)
+    evaluate_indicators(new_indicator_context(yahoo_ticker, '1d', series, persist_zig=True), PREFETCH_ZIG_SPECS)
+
+def claim_prefetch():
+    """在锁内检查并占用预取运行标记，已有预取在运行时返回False"""
+    with prefetch_lock:
+        if prefetch_state['running']:
+            return False
+        prefetch_state['running'] = True
+        return True
+
+def run_prefetch(market=None, tickers=None, claimed=False):
+    """
+    执行一次预取：刷新关注列表+访问最多的股票（可按市场过滤，或直接指定tickers）
+    先并发刷新K线，再逐只按默认阈值续算日线ZIG（只写共享的K线文件和ZIG状态文件，不预热各worker的内存缓存）
+    claimed: 调用方已通过claim_prefetch()占用运行标记（手动触发的后台预取）
+    返回本次预取的报告，已有预取在运行时返回None
+    """
+    if not claimed and not claim_prefetch():
+        print("[PREFETCH] 已有预取任务在运行，跳过")
+        return None
+
+    start_time = time.time()
+    try:
+        if tickers is None:
+            tickers = PREFETCH_WATCHLIST + get_top_requested_tickers(PREFETCH_TOP_N)
+        normalized = []
+        for t in tickers:
+            normalized_ticker, _ = normalize_ticker(t)
+            if normalized_ticker and (market is None or market_of_ticker(normalized_ticker) == market):
+                normalized.append(normalized_ticker)
+        normalized = list(dict.fromkeys(normalized))
+        print(f"[PREFETCH] 开始预取 {market or '全部市场'}: {len(normalized)} 只股票")
+
+        results = {}
+        if normalized:
+            with ThreadPoolExecutor(max_workers=min(PREFETCH_WORKERS, len(normalized))) as executor:
+                futures = {executor.submit(prefetch_ticker_bars, t): t for t in normalized}
+                for future in as_completed(futures):
+                    t = futures[future]
+                    try:
+                        results[t] = future.result()
+                    except Exception as e:
+                        results[t] = {'ticker': t, 'market': market_of_ticker(t), 'success': False,
+                                      'error': str(e), 'steps': {}}
+        bars_elapsed = time.time() - start_time
+
+        for t in normalized:
+            report = results[t]
+            if not report['success']:
+                continue
+            step_start = time.time()
+            try:
+                prefetch_ticker_zig(t)
+            except Exception as e:
+                report['success'] = False
+                report['error'] = str(e)
+            report['steps']['indicators'] = round(time.time() - step_start, 3)
+
+        total_elapsed = time.time() - start_time
+        summary = {
+            'market': market or 'all',
+            'started_at': datetime.datetime.fromtimestamp(start_time).isoformat(),
+            'count': len(normalized),
+            'succeeded': sum(1 for r in results.values() if r['success']),
+            'elapsed': {'bars': round(bars_elapsed, 3), 'indicators': round(total_elapsed - bars_elapsed, 3),
+                        'total': round(total_elapsed, 3)},
+            'results': [results[t] for t in normalized]
+        }
+        with prefetch_lock:
+            prefetch_state['reports'][market or 'all'] = summary
+        print(f"[PREFETCH] 完成 {market or '全部市场'}: {summary['succeeded']}/{summary['count']} 成功，"
+              f"K线 {bars_elapsed:.1f}s，指标 {total_elapsed - bars_elapsed:.1f}s")
+        return summary
+    finally:
+        with prefetch_lock:
+            prefetch_state['running'] = False
+
+def get_due_prefetch_markets(now=None):
+    """返回已过收盘时间+延迟、且今天还没有预取过的市场列表[(市场, 当地日期)]"""
+    from zoneinfo import ZoneInfo
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    due = []
+    for market, (tz_name, hour, minute) in MARKET_CLOSE_TIMES.items():
+        local_now = now.astimezone(ZoneInfo(tz_name))
+        if local_now.weekday() >= 5:
+            continue
+        run_at = local_now.replace(hour=hour, minute=minute, second=0, microsecond=0) + \
+            datetime.timedelta(minutes=PREFETCH_DELAY_MINUTES)
+        local_date = local_now.date().isoformat()
+        if local_now >= run_at and prefetch_state['last_runs'].get(market) != local_date:
+            due.append((market, local_date))
+    return due
+
+def acquire_prefetch_leadership():
+    """多个gunicorn worker中只允许一个执行定时预取：通过非阻塞文件锁选出执行者"""
+    global prefetch_lock_file
+    if prefetch_lock_file is not None:
+        return True
+    import fcntl
+    os.makedirs(PRICE_STORE_DIR, exist_ok=True)
+    lock_file = open(os.path.join(PRICE_STORE_DIR, '.prefetch.lock'), 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    prefetch_lock_file = lock_file
+    return True
+
+def prefetch_scheduler_loop():
+    """后台调度线程：定期检查各市场是否已收盘，收盘后执行一次预取"""
+    while True:
+        try:
+            if acquire_prefetch_leadership():
+                for market, local_date in get_due_prefetch_markets():
+                    # 已有手动预取在运行时run_prefetch返回None，下次检查时重试，不把当天标记为已预取
+                    if run_prefetch(market=market) is not None:
+                        prefetch_state['last_runs'][market] = local_date
+        except Exception as e:
+            print(f"[PREFETCH] 调度异常: {e}")
+        time.sleep(PREFETCH_CHECK_INTERVAL)
+
+def start_prefetch_scheduler():
+    """PREFETCH_ENABLED=true时在当前进程启动预取调度线程"""
+    if not PREFETCH_ENABLED or prefetch_state['scheduler_started']:
+        return
+    if multiprocessing.parent_process() is not None:
+        return  # 筛选进程池的子进程（spawn时重新导入app）不参与预取调度
+    prefetch_state['scheduler_started'] = True
+    threading.Thread(target=prefetch_scheduler_loop, daemon=True, name='prefetch-scheduler').start()
+    print(f"[PREFETCH] 预取调度已启动: 关注列表 {len(PREFETCH_WATCHLIST)} 只 + 访问最多的 {PREFETCH_TOP_N} 只，"
+          f"收盘后 {PREFETCH_DELAY_MINUTES} 分钟执行")
+
+@app.route('/api/system/prefetch', methods=['GET', 'POST'])
+@require_api_auth
+def prefetch_api():
+    """
+    GET: 查看预取调度状态和最近一次报告
+    POST: 立即在后台执行一次预取，请求体可选 {"market": "CN|HK|US", "tickers": [...]}
+    """
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        market = data.get('market')
+        if market is not None and market not in MARKET_CLOSE_TIMES:
+            return jsonify({'error': f'market必须是 {list(MARKET_CLOSE_TIMES)} 之一'}), 400
+        # 在锁内占用运行标记后再启动线程，并发的POST只有一个得到202
+        if not claim_prefetch():
+            return jsonify({'error': '已有预取任务在运行'}), 409
+        threading.Thread(target=run_prefetch, args=(market, data.get('tickers'), True), daemon=True).start()
+        return jsonify({'success': True, 'message': '预取任务已开始'}), 202
+
+    with prefetch_lock:
+        return jsonify({
+            'success': True,
+            'enabled': PREFETCH_ENABLED,
+            'running': prefetch_state['running'],
+            'watchlist': PREFETCH_WATCHLIST,
+            'top_n': PREFETCH_TOP_N,
+            'last_runs': prefetch_state['last_runs'],
+            'reports': prefetch_state['reports']
+        })
+
+# --- V3.3: 新增结构化分析数据API ---
+@app.route('/api/analysis_data')
+@require_api_auth
+def analysis_data():
+    """
+    提供结构化的股价分析数据API
+    支持所有异常检测和ZIG指标参数的完整配置
+    """
+    import json
+    import datetime as dt
+    
+    # --- 获取所有参数 ---
+    user_input_ticker = request.args.get('ticker', 'ONC')
+    period_param = request.args.get('period', '1d')
+    
+    # --- 智能股票代码识别与转换 ---
+    print(f"[ANALYSIS_API] 用户输入: {user_input_ticker}")
+    
+    # Step 1: 将用户输入标准化为内部格式
+    normalized_ticker, identification_type = normalize_ticker(user_input_ticker)
+    
+    if not normalized_ticker:
+        smart_error_msg = generate_smart_error_message(user_input_ticker, identification_type)
+        return jsonify({'error': smart_error_msg}), 400
+    
     print(f"[ANALYSIS_API] 标准化结果: {user_input_ticker} -> {normalized_ticker} (类型: {identification_type})")
     
     # Step 2: 为Yahoo API准备正确格式
@@ -2936,6 +4587,7 @@ def analysis_data():
     # Step 3: 设置内部使用的ticker（用于缓存和显示）
     ticker = normalized_ticker
     print(f"[ANALYSIS_API] 最终使用 - 内部格式: {ticker}, Yahoo格式: {yahoo_ticker}")
+    record_ticker_request(ticker)  # V6.9
     
     # 异常检测参数
     price_std_multiplier = float(request.args.get('price_std', 1.8))
@@ -2977,157 +4629,87 @@ def analysis_data():
 
     try:
         # --- 复用现有的数据获取逻辑 ---
-        # 根据K线周期设置合适的时间范围
+        # 根据K线周期选择数据粒度，分析窗口为最近10年
         if period_param == '1mo':
-            range_param = '10y'
             interval_param = '1mo'
         elif period_param == '1wk':
-            range_param = '10y'
             interval_param = '1wk'
         else:
-            range_param = '10y'
             interval_param = '1d'
 
-        url = f"https://query1.finance.yahoo.com/v8/finance/chart/{yahoo_ticker}?range={range_param}&interval={interval_param}"
-        print(f"[ANALYSIS_API] 请求Yahoo Finance API: {url}")
         print(f"[ANALYSIS_API] 使用Yahoo格式: {yahoo_ticker} (原始输入: {user_input_ticker})")
-        
-        response = requests.get(url, headers=HEADERS)
-        response.raise_for_status()
-        
-        yahoo_data = response.json()
-        result = yahoo_data.get('chart', {}).get('result', [])
-        if not result:
-            return jsonify({'error': f"无法获取 '{ticker}' 的数据"}), 404
 
-        res = result[0]
-        timestamps = res.get('timestamp', [])
-        ohlc = res.get('indicators', {}).get('quote', [{}])[0]
-
-        if not timestamps or not ohlc.get('open'):
+        # V6.0: 从K线缓存读取，再截取最近10年
+        window_start = int(dt.datetime.now().timestamp()) - 365 * 10 * 86400
+        series, error_type, error_detail = get_price_series(yahoo_ticker, interval_param, start=window_start)
+        if error_type == 'not_found':
+            return jsonify({'error': f"无法获取 '{ticker}' 的数据"}), 404
+        if error_type in ('invalid_response', 'rate_limited'):
+            return jsonify({'error': 'Yahoo Finance请求频率受限，请稍后重试'}), 503
+        if series is None:
             return jsonify({'error': f"数据格式不完整"}), 500
-        
-        # 数据处理
-        df = pd.DataFrame({
-            'timestamp': timestamps,
-            'open': ohlc['open'],
-            'high': ohlc['high'],
-            'low': ohlc['low'],
-            'close': ohlc['close'],
-            'volume': ohlc['volume']
-        }).dropna().copy()
+
+        df = price_series_to_frame(series)
 
         # --- 异常检测分析 ---
-        anomaly_results = {
-            'price_volume_events': [],
-            'volume_stable_price_events': [],
-            'price_only_events': [],
-            'volume_only_events': []
+        anomaly_results = {f'{rule}_events': [] for rule in ANOMALY_RULES}
+
+        # V7.5: 与stock_data共用向量化异常检测；V7.8: 指标由注册表按需计算
+        anomaly_spec = ('anomalies', price_std_multiplier, volume_std_multiplier, price_only_std_multiplier, volume_only_std_multiplier)
+        zig_specs = {
+            'zig5': ('zig', 'ma5', short_term_zig_threshold),
+            'zig25': ('zig', 'ma25', medium_term_zig_threshold),
+            'zig50': ('zig', 'ma50', long_term_zig_threshold),
+            'volume_zig5': ('zig', 'volume_ma5', volume_short_term_zig_threshold),
+            'volume_zig25': ('zig', 'volume_ma25', volume_medium_term_zig_threshold),
+            'volume_zig50': ('zig', 'volume_ma50', volume_long_term_zig_threshold)
         }
+        phase_zig = zig_specs[zig_phase_source if zig_phase_source in ('zig5', 'zig25', 'zig50') else 'zig50']
+        volume_phase_zig = zig_specs[volume_zig_phase_source if volume_zig_phase_source in ('volume_zig5', 'volume_zig25', 'volume_zig50') else 'volume_zig50']
+        phase_spec = ('phases',) + phase_zig[1:]
+        volume_phase_spec = ('phases',) + volume_phase_zig[1:]
+        indicators = evaluate_indicators(new_indicator_context(yahoo_ticker, interval_param, series),
+                                         [anomaly_spec, ('dates',), phase_spec, volume_phase_spec] + list(zig_specs.values()))
+        events = indicators[anomaly_spec]
+        event_columns = zip(
+            events['rule'].tolist(),
+            events['date'].tolist(),
+            np.round(events['pct'] * 100, 2).tolist(),
+            events['volume'].astype('int64').tolist(),
+            np.round(events['close'], 2).tolist(),
+            anomaly_event_types(events)
+        )
+        for code, date_str, pct, volume, close_price, event_type in event_columns:
+            anomaly_results[f'{ANOMALY_RULES[code]}_events'].append({
+                'date': date_str,
+                'price_change_pct': pct,
+                'volume': volume,
+                'close_price': close_price,
+                'type': event_type
+            })
 
-        analysis_period = 60
-        if len(df) > analysis_period:
-            # 计算动态基准
-            df['prev_close'] = df['close'].shift(1)
-            df['price_change_pct'] = (df['close'] - df['prev_close']) / df['prev_close']
-            df['price_change_std'] = df['price_change_pct'].rolling(window=analysis_period).std()
-            df['volume_mean'] = df['volume'].rolling(window=analysis_period).mean()
-            df['volume_std'] = df['volume'].rolling(window=analysis_period).std()
-
-            # 异常条件判断
-            is_abnormal_price_for_volume = df['price_change_pct'].abs() > (df['price_change_std'] * price_std_multiplier)
-            is_abnormal_price_only = df['price_change_pct'].abs() > (df['price_change_std'] * price_only_std_multiplier)
-            is_abnormal_volume = df['volume'] > (df['volume_mean'] + df['volume_std'] * volume_std_multiplier)
-            is_stable_price = df['price_change_pct'].abs() < 0.01
-            is_abnormal_volume_only = df['volume'] > (df['volume_mean'] + df['volume_std'] * volume_only_std_multiplier)
-
-            # 规则一：价量齐升/跌
-            for _, row in df[is_abnormal_price_for_volume & is_abnormal_volume].iterrows():
-                anomaly_results['price_volume_events'].append({
-                    'date': dt.datetime.fromtimestamp(row['timestamp']).strftime('%Y-%m-%d'),
-                    'price_change_pct': round(row['price_change_pct'] * 100, 2),
-                    'volume': int(row['volume']),
-                    'close_price': round(row['close'], 2),
-                    'type': '上涨' if row['price_change_pct'] > 0 else '下跌'
-                })
-
-            # 规则二：放量滞涨/跌
-            for _, row in df[is_abnormal_volume & is_stable_price].iterrows():
-                anomaly_results['volume_stable_price_events'].append({
-                    'date': dt.datetime.fromtimestamp(row['timestamp']).strftime('%Y-%m-%d'),
-                    'price_change_pct': round(row['price_change_pct'] * 100, 2),
-                    'volume': int(row['volume']),
-                    'close_price': round(row['close'], 2),
-                    'type': '滞涨' if row['price_change_pct'] >= 0 else '滞跌'
-                })
-
-            # 规则三：仅价格异常
-            for _, row in df[is_abnormal_price_only & ~is_abnormal_volume].iterrows():
-                anomaly_results['price_only_events'].append({
-                    'date': dt.datetime.fromtimestamp(row['timestamp']).strftime('%Y-%m-%d'),
-                    'price_change_pct': round(row['price_change_pct'] * 100, 2),
-                    'volume': int(row['volume']),
-                    'close_price': round(row['close'], 2),
-                    'type': '上涨' if row['price_change_pct'] > 0 else '下跌'
-                })
-
-            # 规则四：仅成交量异常
-            for _, row in df[is_abnormal_volume_only & ~is_abnormal_price_for_volume & ~is_stable_price].iterrows():
-                anomaly_results['volume_only_events'].append({
-                    'date': dt.datetime.fromtimestamp(row['timestamp']).strftime('%Y-%m-%d'),
-                    'price_change_pct': round(row['price_change_pct'] * 100, 2),
-                    'volume': int(row['volume']),
-                    'close_price': round(row['close'], 2),
-                    'type': '放量'
-                })
+        # --- ZIG指标分析（V8.2: 直接由拐点数组生成转折点，日期取自按序列缓存的日期数组） ---
+        dates = indicators[('dates',)]
 
-        # --- ZIG指标分析 ---
-        # 计算均线
-        df['ma5'] = df['close'].rolling(window=5).mean()
-        df['ma25'] = df['close'].rolling(window=25).mean()
-        df['ma50'] = df['close'].rolling(window=50).mean()
-        df['volume_ma5'] = df['volume'].rolling(window=5).mean()
-        df['volume_ma25'] = df['volume'].rolling(window=25).mean()
-        df['volume_ma50'] = df['volume'].rolling(window=50).mean()
-
-        # 计算ZIG指标
-        zig5 = calculate_zig(df['ma5'], short_term_zig_threshold)
-        zig25 = calculate_zig(df['ma25'], medium_term_zig_threshold)
-        zig50 = calculate_zig(df['ma50'], long_term_zig_threshold)
-        volume_zig5 = calculate_zig(df['volume_ma5'], volume_short_term_zig_threshold)
-        volume_zig25 = calculate_zig(df['volume_ma25'], volume_medium_term_zig_threshold)
-        volume_zig50 = calculate_zig(df['volume_ma50'], volume_long_term_zig_threshold)
-
-        # 提取ZIG转折点
-        def extract_zig_points(zig_series, timestamps, zig_name):
-            points = []
-            for i, value in enumerate(zig_series):
-                if value is not None:
-                    points.append({
-                        'date': dt.datetime.fromtimestamp(timestamps[i]).strftime('%Y-%m-%d'),
-                        'value': round(value, 2),
-                        'index': i,
-                        'zig_type': zig_name
-                    })
-            return points
+        def extract_zig_points(pivots, zig_name):
+            indices, pivot_values = pivots
+            return [
+                {'date': date_str, 'value': round(value, 2), 'index': index, 'zig_type': zig_name}
+                for index, value, date_str in zip(indices.tolist(), pivot_values.tolist(), dates[indices].tolist())
+            ]
 
         zig_analysis = {
-            'zig5_points': extract_zig_points(zig5, df['timestamp'].tolist(), 'short_term'),
-            'zig25_points': extract_zig_points(zig25, df['timestamp'].tolist(), 'medium_term'),
-            'zig50_points': extract_zig_points(zig50, df['timestamp'].tolist(), 'long_term'),
-            'volume_zig5_points': extract_zig_points(volume_zig5, df['timestamp'].tolist(), 'volume_short_term'),
-            'volume_zig25_points': extract_zig_points(volume_zig25, df['timestamp'].tolist(), 'volume_medium_term'),
-            'volume_zig50_points': extract_zig_points(volume_zig50, df['timestamp'].tolist(), 'volume_long_term')
+            'zig5_points': extract_zig_points(indicators[zig_specs['zig5']], 'short_term'),
+            'zig25_points': extract_zig_points(indicators[zig_specs['zig25']], 'medium_term'),
+            'zig50_points': extract_zig_points(indicators[zig_specs['zig50']], 'long_term'),
+            'volume_zig5_points': extract_zig_points(indicators[zig_specs['volume_zig5']], 'volume_short_term'),
+            'volume_zig25_points': extract_zig_points(indicators[zig_specs['volume_zig25']], 'volume_medium_term'),
+            'volume_zig50_points': extract_zig_points(indicators[zig_specs['volume_zig50']], 'volume_long_term')
         }
 
-        # --- 市场阶段分析 ---
-        zig_map = {'zig5': zig5, 'zig25': zig25, 'zig50': zig50}
-        selected_zig = zig_map.get(zig_phase_source, zig50)
-        market_phases = calculate_phases_from_zig(selected_zig, df['timestamp'].tolist())
-
-        volume_zig_map = {'volume_zig5': volume_zig5, 'volume_zig25': volume_zig25, 'volume_zig50': volume_zig50}
-        selected_volume_zig = volume_zig_map.get(volume_zig_phase_source, volume_zig50)
-        volume_phases = calculate_phases_from_zig(selected_volume_zig, df['timestamp'].tolist())
+        # --- 市场阶段分析（区间划分结果可能被缓存共享，复制后再返回） ---
+        market_phases = [dict(phase) for phase in indicators[phase_spec]]
+        volume_phases = [dict(phase) for phase in indicators[volume_phase_spec]]
 
         # --- 统计信息 ---
         statistics = {
@@ -3279,6 +4861,22 @@ def search_stocks():
             'error': str(e)
         }), 500
 
+# --- V8.3: 趋势区间的有序索引 ---
+# 注释日期和K线时间戳都保持为升序整数数组，区间内的注释和区间端点的股价都用searchsorted定位，
+# 不再对每个区间重新解析全部注释日期、扫描整列时间戳
+def date_strings_to_days(dates):
+    """把YYYY-MM-DD字符串批量转换为整数天数（自1970-01-01起），顺序与日期一致"""
+    return np.array(dates, dtype='datetime64[D]').astype('int64')
+
+def nearest_bar_index(timestamps, target):
+    """在升序时间戳数组中查找最接近target的K线下标（距离相同时取较早的一根，与idxmin一致）"""
+    i = int(np.searchsorted(timestamps, target, side='left'))
+    if i == 0:
+        return 0
+    if i == len(timestamps):
+        return i - 1
+    return i - 1 if target - timestamps[i - 1] <= timestamps[i] - target else i
+
 # --- V4.5: 新增趋势区间分析API ---
 @app.route('/api/trend-analysis')
 @require_api_auth
@@ -3328,48 +4926,27 @@ def trend_analysis():
         period1 = int(start_date.timestamp())
         period2 = int(end_date.timestamp())
 
-        # 获取股价数据
-        url = f"https://query1.finance.yahoo.com/v8/finance/chart/{yahoo_ticker}?period1={period1}&period2={period2}&interval=1d"
-        response = requests.get(url, headers=HEADERS)
-        response.raise_for_status()
-        
-        yahoo_data = response.json()
-        result = yahoo_data.get('chart', {}).get('result', [])
-        if not result:
+        # V6.0: 从K线缓存读取日线，再截取所需时间段
+        series, error_type, error_detail = get_price_series(yahoo_ticker, '1d', start=period1, end=period2)
+        if error_type == 'not_found':
             return jsonify({'error': f"无法获取 '{ticker}' 的股价数据"}), 404
-        
-        res = result[0]
-        timestamps = res.get('timestamp', [])
-        ohlc = res.get('indicators', {}).get('quote', [{}])[0]
-        
-        if not timestamps or not ohlc.get('open'):
+        if error_type in ('invalid_response', 'rate_limited'):
+            return jsonify({'error': 'Yahoo Finance请求频率受限，请稍后重试'}), 503
+        if series is None:
             return jsonify({'error': f"数据格式不完整，无法解析 '{ticker}' 的股价"}), 500
-        
-        # 创建DataFrame进行分析
-        df = pd.DataFrame({
-            'timestamp': timestamps,
-            'open': ohlc['open'],
-            'high': ohlc['high'],
-            'low': ohlc['low'],
-            'close': ohlc['close'],
-            'volume': ohlc['volume']
-        })
-        
-        # 清理数据
-        df = df.dropna().copy()
+
+        df = price_series_to_frame(series)
         if df.empty:
             return jsonify({'error': '数据清理后为空'}), 500
         
-        # 计算50日移动平均线（与前端保持一致）
-        df['ma50'] = df['close'].rolling(window=50).mean()
-        
-        # 计算ZIG指标（从URL参数获取，默认值为25，基于MA50均线）
+        # 计算ZIG指标（从URL参数获取，默认值为25，基于MA50均线，与前端保持一致）
         zig_threshold = float(request.args.get('long_term_zig', 25))
         print(f"[TREND_API] 使用ZIG阈值: {zig_threshold}%，基于MA50均线")
-        zig_series = calculate_zig(df['ma50'], zig_threshold)
         
-        # 计算趋势区间
-        market_phases = calculate_phases_from_zig(zig_series, df['timestamp'].tolist())
+        # 计算趋势区间（V7.8: 由指标注册表计算 MA50 → ZIG → 区间，结果按参数缓存）
+        phase_spec = ('phases', 'ma50', zig_threshold)
+        indicators = evaluate_indicators(new_indicator_context(yahoo_ticker, '1d', series), [phase_spec, ('dates',)])
+        market_phases = [dict(phase) for phase in indicators[phase_spec]]
         
         # 如果指定了时间段，进行筛选
         if period_param != 'all':
@@ -3406,53 +4983,54 @@ def trend_analysis():
         annotations_data = cursor.fetchall()
         cursor.close()
         db.close()
+
+        # V8.3: 注释按日期排成整数天数组（稳定排序，同日保持查询顺序），区间内的注释用二分查找切片
+        annotation_days = date_strings_to_days([annotation['date'] for annotation in annotations_data])
+        order = np.argsort(annotation_days, kind='stable')
+        annotation_days = annotation_days[order]
+        period_anomaly_items = []
+        for i in order.tolist():
+            annotation = annotations_data[i]
+            anomaly_type = annotation['algorithm_type'] if annotation['annotation_type'] == 'algorithm' else 'manual'
+            period_anomaly_items.append({
+                'date': annotation['date'],
+                'text': annotation['text'],
+                'type': anomaly_type
+            })
+
+        def anomalies_between(start_day, end_day):
+            lo = int(np.searchsorted(annotation_days, start_day, side='left'))
+            hi = int(np.searchsorted(annotation_days, end_day, side='right'))
+            return period_anomaly_items[lo:hi]
+
+        timestamps = series['timestamp']
+        closes = series['close']
+
+        def close_near(target_timestamp):
+            idx = nearest_bar_index(timestamps, target_timestamp)
+            return None if np.isnan(closes[idx]) else round(closes[idx], 2)
+
+        phase_start_days = date_strings_to_days([phase['start_date'] for phase in market_phases])
+        phase_end_days = date_strings_to_days([phase['end_date'] for phase in market_phases])
         
         # 为每个区间关联异常点
         trend_periods = []
-        for phase in market_phases:
+        for phase, start_day, end_day in zip(market_phases, phase_start_days.tolist(), phase_end_days.tolist()):
             # 转换phase类型为中文
             phase_chinese = "上涨区间" if phase['phase'] == 'Uptrend' else "下跌区间"
             
             # 计算区间持续天数
-            start_date = dt.datetime.strptime(phase['start_date'], '%Y-%m-%d')
-            end_date = dt.datetime.strptime(phase['end_date'], '%Y-%m-%d')
-            duration_days = (end_date - start_date).days
-            
-            # 获取起始和结束日期的股价
-            start_timestamp = start_date.timestamp()
-            end_timestamp = end_date.timestamp()
+            duration_days = end_day - start_day
             
-            # 从DataFrame中查找最接近的股价数据
-            start_price = None
-            end_price = None
+            # 获取起始和结束日期（本地零点）最接近的收盘价
+            start_price = close_near(dt.datetime.strptime(phase['start_date'], '%Y-%m-%d').timestamp())
+            end_price = close_near(dt.datetime.strptime(phase['end_date'], '%Y-%m-%d').timestamp())
             price_change_pct = None
             
-            # 查找起始日期的股价（收盘价）
-            start_idx = (df['timestamp'] - start_timestamp).abs().idxmin()
-            if not pd.isna(df.loc[start_idx, 'close']):
-                start_price = round(df.loc[start_idx, 'close'], 2)
-            
-            # 查找结束日期的股价（收盘价）
-            end_idx = (df['timestamp'] - end_timestamp).abs().idxmin()
-            if not pd.isna(df.loc[end_idx, 'close']):
-                end_price = round(df.loc[end_idx, 'close'], 2)
-            
             # 计算涨跌幅
             if start_price and end_price:
                 price_change_pct = round(((end_price - start_price) / start_price) * 100, 2)
             
-            # 筛选该区间内的异常点
-            period_anomalies = []
-            for annotation in annotations_data:
-                annotation_date = dt.datetime.strptime(annotation['date'], '%Y-%m-%d')
-                if start_date <= annotation_date <= end_date:
-                    anomaly_type = annotation['algorithm_type'] if annotation['annotation_type'] == 'algorithm' else 'manual'
-                    period_anomalies.append({
-                        'date': annotation['date'],
-                        'text': annotation['text'],
-                        'type': anomaly_type
-                    })
-            
             trend_periods.append({
                 'phase': phase_chinese,
                 'start_date': phase['start_date'],
@@ -3461,7 +5039,7 @@ def trend_analysis():
                 'start_price': start_price,
                 'end_price': end_price,
                 'price_change_pct': price_change_pct,
-                'anomalies': period_anomalies
+                'anomalies': anomalies_between(start_day, end_day)
             })
         
         # V5.7: 优化最后一个区间，消除时间缺口问题
@@ -3498,21 +5076,8 @@ def trend_analysis():
                     })
                     
                     # V5.7.1: 重新筛选扩展区间内的anomalies，确保数据完整性
-                    extended_end_date = current_date
-                    start_date_obj = dt.datetime.strptime(last_period['start_date'], '%Y-%m-%d')
-                    extended_anomalies = []
-                    
-                    print(f"[TREND_API] 重新筛选anomalies: {last_period['start_date']} -> {extended_end_date.strftime('%Y-%m-%d')}")
-                    
-                    for annotation in annotations_data:
-                        annotation_date = dt.datetime.strptime(annotation['date'], '%Y-%m-%d')
-                        if start_date_obj <= annotation_date <= extended_end_date:
-                            anomaly_type = annotation['algorithm_type'] if annotation['annotation_type'] == 'algorithm' else 'manual'
-                            extended_anomalies.append({
-                                'date': annotation['date'],
-                                'text': annotation['text'],
-                                'type': anomaly_type
-                            })
+                    print(f"[TREND_API] 重新筛选anomalies: {last_period['start_date']} -> {current_date.strftime('%Y-%m-%d')}")
+                    extended_anomalies = anomalies_between(int(phase_start_days[-1]), int(np.datetime64(current_date.date(), 'D').astype('int64')))
                     
                     # 更新anomalies
                     trend_periods[-1]['anomalies'] = extended_anomalies
@@ -3522,41 +5087,27 @@ def trend_analysis():
         
         # V5.7.x: 如起始存在空白区间，向前延伸首个区间以填补缺口
         if trend_periods:
-            earliest_ts = df['timestamp'].min()
-            earliest_date = dt.datetime.fromtimestamp(earliest_ts).strftime('%Y-%m-%d')
-            
+            earliest_date = str(indicators[('dates',)][0])
             first_period = trend_periods[0]
-            first_start_obj = dt.datetime.strptime(first_period['start_date'], '%Y-%m-%d')
-            earliest_date_obj = dt.datetime.strptime(earliest_date, '%Y-%m-%d')
+            earliest_day, first_start_day, end_day = date_strings_to_days(
+                [earliest_date, first_period['start_date'], first_period['end_date']]).tolist()
             
-            if earliest_date_obj < first_start_obj:
+            if earliest_day < first_start_day:
                 print(f"[TREND_API] 发现起始缺口: {first_period['start_date']} 之前存在数据，向前延伸至 {earliest_date}")
                 
-                end_date_obj = dt.datetime.strptime(first_period['end_date'], '%Y-%m-%d')
                 first_period['start_date'] = earliest_date
-                first_period['duration_days'] = (end_date_obj - earliest_date_obj).days
+                first_period['duration_days'] = end_day - earliest_day
                 
                 # 重新计算起始价格与涨跌幅
-                start_idx = (df['timestamp'] - earliest_date_obj.timestamp()).abs().idxmin()
-                if not pd.isna(df.loc[start_idx, 'close']):
-                    first_period['start_price'] = round(df.loc[start_idx, 'close'], 2)
+                start_price = close_near(dt.datetime.strptime(earliest_date, '%Y-%m-%d').timestamp())
+                if start_price is not None:
+                    first_period['start_price'] = start_price
                 
                 if first_period.get('start_price') and first_period.get('end_price'):
                     first_period['price_change_pct'] = round(((first_period['end_price'] - first_period['start_price']) / first_period['start_price']) * 100, 2)
                 
                 # 重新筛选延伸后区间内的异常点
-                extended_anomalies = []
-                for annotation in annotations_data:
-                    annotation_date = dt.datetime.strptime(annotation['date'], '%Y-%m-%d')
-                    if earliest_date_obj <= annotation_date <= end_date_obj:
-                        anomaly_type = annotation['algorithm_type'] if annotation['annotation_type'] == 'algorithm' else 'manual'
-                        extended_anomalies.append({
-                            'date': annotation['date'],
-                            'text': annotation['text'],
-                            'type': anomaly_type
-                        })
-                
-                first_period['anomalies'] = extended_anomalies
+                first_period['anomalies'] = anomalies_between(earliest_day, end_day)
                 print(f"[TREND_API] 起始区间延伸完成: {earliest_date} -> {first_period['end_date']}, 涨跌幅: {first_period.get('price_change_pct')}")
         
         # V5.7: 基于优化后的趋势区间判断当前股价状态
@@ -3611,6 +5162,479 @@ def trend_analysis():
         print(f"[ERROR] 趋势分析API失败: {str(e)}")
         return jsonify({'error': f'趋势分析失败: {str(e)}'}), 500
 
+# --- V7.3: ZIG阈值扫描API ---
+ZIG_SWEEP_SOURCES = ['close', 'ma5', 'ma25', 'ma50', 'volume', 'volume_ma5', 'volume_ma25', 'volume_ma50']
+ZIG_SWEEP_MAX_THRESHOLDS = 100
+
+def parse_zig_sweep_thresholds(args):
+    """解析阈值网格：thresholds=5,10,20 或 min/max/step（默认2%~40%，步长2%）"""
+    if args.get('thresholds'):
+        thresholds = [float(t) for t in args.get('thresholds').split(',') if t.strip()]
+    else:
+        low = float(args.get('min', 2))
+        high = float(args.get('max', 40))
+        step = float(args.get('step', 2))
+        if step <= 0:
+            raise ValueError('step必须大于0')
+        thresholds = [round(low + i * step, 6) for i in range(int((high - low) / step + 1e-9) + 1)]
+    thresholds = sorted(set(t for t in thresholds if t > 0))
+    if not thresholds:
+        raise ValueError('没有有效的阈值')
+    if len(thresholds) > ZIG_SWEEP_MAX_THRESHOLDS:
+        raise ValueError(f'单次最多扫描 {ZIG_SWEEP_MAX_THRESHOLDS} 个阈值')
+    return thresholds
+
+@app.route('/api/zig/sweep')
+@require_api_auth
+def zig_sweep():
+    """
+    ZIG阈值扫描：对同一条均线一次计算一组阈值，返回每个阈值的拐点数和区间数，
+    用户可据此直接选择阈值，而不必反复拖动滑块重新加载
+    参数：ticker, period(1d/1wk/1mo), source(ma50等，见ZIG_SWEEP_SOURCES), thresholds 或 min/max/step
+    """
+    user_input_ticker = request.args.get('ticker', 'AAPL')
+    period_param = request.args.get('period', '1d')
+    source = request.args.get('source', 'ma50')
+    if source not in ZIG_SWEEP_SOURCES:
+        return jsonify({'error': f'source必须是 {list(ZIG_SWEEP_SOURCES)} 之一'}), 400
+    try:
+        thresholds = parse_zig_sweep_thresholds(request.args)
+    except ValueError as e:
+        return jsonify({'error': f'阈值参数错误: {e}'}), 400
+
+    normalized_ticker, identification_type = normalize_ticker(user_input_ticker)
+    if not normalized_ticker:
+        smart_error_msg = generate_smart_error_message(user_input_ticker, identification_type)
+        return jsonify({'error': smart_error_msg}), 400
+
+    interval = period_param if period_param in ('1wk', '1mo') else '1d'
+    try:
+        yahoo_ticker = to_yahoo_format(normalized_ticker)
+        series, error_type, error_detail = get_price_series(yahoo_ticker, interval)
+        if error_type == 'not_found':
+            return jsonify({'error': f"无法获取 '{normalized_ticker}' 的数据"}), 404
+        if error_type in ('invalid_response', 'rate_limited'):
+            return jsonify({'error': 'Yahoo Finance请求频率受限，请稍后重试'}), 503
+        if series is None:
+            return jsonify({'error': "数据格式不完整"}), 500
+
+        start_time = time.time()
+        # V7.8: 数据源（原始列或均线）由指标注册表提供，与图表接口共用滚动统计缓存
+        source_spec = zig_source_spec(source)
+        values = evaluate_indicators(new_indicator_context(yahoo_ticker, interval, series), [source_spec])[source_spec]
+        pivots = calculate_zig_pivots_multi(values, thresholds)
+
+        bars = len(values)
+        results = []
+        for threshold in thresholds:
+            summary = summarize_zig_pivots(pivots[threshold][1])
+            summary['threshold'] = threshold
+            summary['avg_phase_bars'] = round(bars / summary['phase_count'], 1) if summary['phase_count'] else None
+            results.append(summary)
+
+        return jsonify({
+            'success': True,
+            'ticker': normalized_ticker,
+            'period': period_param,
+            'source': source,
+            'bars': bars,
+            'elapsed_ms': round((time.time() - start_time) * 1000, 2),
+            'results': results
+        })
+    except Exception as e:
+        print(f"[ERROR] ZIG阈值扫描失败: {str(e)}")
+        return jsonify({'error': f'ZIG阈值扫描失败: {str(e)}'}), 500
+
+# --- V8.0: 异常阈值网格搜索API ---
+# 四个标准差倍数各占一个维度，检测器掩码沿参数维度广播求值：每个条件按其参数的取值个数只算一遍，
+# 组合数再多也只是一次数组运算；只读取缓存的滚动统计，不写入算法注释
+ANOMALY_GRID_DEFAULTS = {'price_std': 1.8, 'volume_std': 1.8, 'price_only_std': 2.5, 'volume_only_std': 3.0}
+ANOMALY_GRID_MAX_COMBINATIONS = 1000
+
+def parse_anomaly_grid_values(args, name):
+    """解析一个倍数的取值：price_std=1.5,2,2.5 或 price_std=1.5:3:0.5（起:止:步长，含终点），缺省为图表接口的默认值"""
+    raw = args.get(name)
+    if not raw:
+        return [ANOMALY_GRID_DEFAULTS[name]]
+    if ':' in raw:
+        low, high, step = (float(part) for part in raw.split(':'))
+        if step <= 0:
+            raise ValueError(f'{name}的步长必须大于0')
+        values = [round(low + i * step, 6) for i in range(int((high - low) / step + 1e-9) + 1)]
+    else:
+        values = [float(v) for v in raw.split(',') if v.strip()]
+    values = sorted(set(v for v in values if v > 0))
+    if not values:
+        raise ValueError(f'{name}没有有效的取值')
+    return values
+
+@app.route('/api/anomaly/grid')
+@require_api_auth
+def anomaly_grid_search():
+    """
+    异常阈值网格搜索：一次返回所有倍数组合下每条规则的事件数和事件日期，用于挑选price_std等参数
+    参数：ticker, period(1d/1wk/1mo), price_std/volume_std/price_only_std/volume_only_std（取值列表或起:止:步长），
+    dates=false 时只返回事件数
+    """
+    user_input_ticker = request.args.get('ticker', 'AAPL')
+    period_param = request.args.get('period', '1d')
+    include_dates = request.args.get('dates', 'true').lower() != 'false'
+    try:
+        grid = {name: parse_anomaly_grid_values(request.args, name) for name in ANOMALY_GRID_DEFAULTS}
+    except ValueError as e:
+        return jsonify({'error': f'倍数参数错误: {e}'}), 400
+    shape = tuple(len(values) for values in grid.values())
+    if int(np.prod(shape)) > ANOMALY_GRID_MAX_COMBINATIONS:
+        return jsonify({'error': f'单次最多搜索 {ANOMALY_GRID_MAX_COMBINATIONS} 个组合'}), 400
+
+    normalized_ticker, identification_type = normalize_ticker(user_input_ticker)
+    if not normalized_ticker:
+        smart_error_msg = generate_smart_error_message(user_input_ticker, identification_type)
+        return jsonify({'error': smart_error_msg}), 400
+
+    interval = period_param if period_param in ('1wk', '1mo') else '1d'
+    try:
+        yahoo_ticker = to_yahoo_format(normalized_ticker)
+        series, error_type, error_detail = get_price_series(yahoo_ticker, interval)
+        if error_type == 'not_found':
+            return jsonify({'error': f"无法获取 '{normalized_ticker}' 的数据"}), 404
+        if error_type in ('invalid_response', 'rate_limited'):
+            return jsonify({'error': 'Yahoo Finance请求频率受限，请稍后重试'}), 503
+        if series is None:
+            return jsonify({'error': "数据格式不完整"}), 500
+
+        start_time = time.time()
+        stats = evaluate_indicators(new_indicator_context(yahoo_ticker, interval, series), [('rolling_stats',)])[('rolling_stats',)]
+        bars = len(stats['close'])
+
+        # 第i个倍数的取值放在第i维，最后一维是K线轴
+        params = {}
+        for axis, (name, values) in enumerate(grid.items()):
+            axis_shape = [1] * (len(shape) + 1)
+            axis_shape[axis] = len(values)
+            params[name] = np.array(values).reshape(axis_shape)
+        ndim = len(shape) + 1
+        if bars > ANOMALY_ANALYSIS_PERIOD:
+            masks = [mask.reshape((1,) * (ndim - mask.ndim) + mask.shape)
+                     for mask in evaluate_anomaly_detectors(stats, params)[0]]
+        else:
+            masks = [np.zeros((1,) * len(shape) + (bars,), dtype=bool) for _ in ANOMALY_RULES]
+        counts = [np.broadcast_to(mask.sum(axis=-1), shape) for mask in masks]
+
+        if include_dates:
+            hit_any = reduce(np.logical_or, [mask.reshape(-1, mask.shape[-1]).any(axis=0) for mask in masks])
+            dates = np.empty(hit_any.shape[-1], dtype=object)
+            dates[hit_any] = format_local_dates(stats['timestamp'][hit_any]).tolist()
+            # 掩码只在其用到的参数维度上展开，同一检测器在其余参数不同的组合间共享日期列表
+            date_lists = [{} for _ in masks]
+
+        results = []
+        for combination in np.ndindex(*shape):
+            item = {name: grid[name][i] for name, i in zip(grid, combination)}
+            item['counts'] = {rule: int(counts[code][combination]) for code, rule in enumerate(ANOMALY_RULES)}
+            item['total'] = sum(item['counts'].values())
+            if include_dates:
+                item['dates'] = {}
+                for code, rule in enumerate(ANOMALY_RULES):
+                    mask = masks[code]
+                    key = tuple(min(i, size - 1) for i, size in zip(combination, mask.shape))
+                    if key not in date_lists[code]:
+                        date_lists[code][key] = dates[np.flatnonzero(mask[key])].tolist()
+                    item['dates'][rule] = date_lists[code][key]
+            results.append(item)
+
+        return jsonify({
+            'success': True,
+            'ticker': normalized_ticker,
+            'period': period_param,
+            'bars': bars,
+            'rules': ANOMALY_RULES,
+            'grid': grid,
+            'combinations': len(results),
+            'elapsed_ms': round((time.time() - start_time) * 1000, 2),
+            'results': results
+        })
+    except Exception as e:
+        print(f"[ERROR] 异常阈值网格搜索失败: {str(e)}")
+        return jsonify({'error': f'异常阈值网格搜索失败: {str(e)}'}), 500
+
+# --- V8.1: 全市场异常筛选 ---
+# 对company_names中的A股全市场名单（stock_list_local来源）在本地K线缓存上运行异常规则和当前区间判断，
+# 不请求Yahoo（未缓存K线的股票记为missing，可先由预取或批量接口拉取）。
+# 每只股票的筛选结果按K线文件的(inode, mtime, size)缓存，K线刷新后才重新计算；
+# 需要重新计算的股票分块交给进程池（计算都是纯数组运算，子进程不使用任何锁）；
+# 进程池在首次需要时创建并常驻，用spawn启动子进程，避免在已有后台线程的worker进程中fork
+SCREENER_WORKERS = int(os.environ.get('SCREENER_WORKERS', os.cpu_count() or 1))  # 筛选进程数
+SCREENER_CHUNK_SIZE = 64  # 每个子任务处理的股票数，不超过一块时直接在当前进程计算
+SCREENER_LOOKBACK_DAYS = 365  # 每只股票缓存最近一年内的异常事件，查询时再按days过滤
+SCREENER_CACHE_KEYS = 4  # 缓存的参数组合数量
+SCREENER_UNIVERSE_TTL = 3600  # 股票名单的缓存时间（秒）
+SCREENER_ZIG_SOURCES = ['close', 'ma5', 'ma25', 'ma50']
+screener_cache = OrderedDict()  # 参数组合 -> {yahoo_ticker: (K线文件stamp, 筛选结果)}
+screener_state = {'universe': None, 'universe_loaded_at': 0, 'last_run': None, 'pool': None}
+screener_lock = threading.Lock()
+
+def load_screener_universe():
+    """读取A股全市场名单，返回[(ticker, yahoo_ticker, 公司名称)]，按SCREENER_UNIVERSE_TTL缓存"""
+    with screener_lock:
+        if screener_state['universe'] is not None and time.time() - screener_state['universe_loaded_at'] < SCREENER_UNIVERSE_TTL:
+            return screener_state['universe']
+    db = get_db()
+    cursor = db.cursor()
+    db_execute(cursor, "SELECT ticker, company_name FROM company_names WHERE source = %s ORDER BY ticker", ('stock_list_local',))
+    rows = cursor.fetchall()
+    cursor.close()
+    db.close()
+    universe = [(row['ticker'], to_yahoo_format(row['ticker']), row['company_name']) for row in rows]
+    with screener_lock:
+        screener_state['universe'] = universe
+        screener_state['universe_loaded_at'] = time.time()
+    return universe
+
+def price_file_stamp(yahoo_ticker):
+    """日线K线文件的(inode, mtime, size)，无缓存时返回None"""
+    try:
+        stat = os.stat(price_store_path(yahoo_ticker, '1d'))
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+def screen_ticker(yahoo_ticker, params):
+    """
+    在缓存的日线上对单只股票运行异常规则和当前区间判断
+    params: 四个标准差倍数和 zig_source / zig_threshold
+    返回：(K线文件stamp, 结果)，结果含最近SCREENER_LOOKBACK_DAYS天的列式事件和当前区间；无缓存时返回(None, None)
+    """
+    stamp = price_file_stamp(yahoo_ticker)
+    if stamp is None:
+        return None, None
+    columns, fetched_at, generation = load_price_columns(yahoo_ticker, '1d')
+    if columns is None or len(columns['timestamp']) == 0:
+        return None, None
+    stats = compute_rolling_stats(columns)
+    timestamps = stats['timestamp']
+    bars = len(timestamps)
+
+    index = np.empty(0, dtype='int64')
+    rule = np.empty(0, dtype='int8')
+    if bars > ANOMALY_ANALYSIS_PERIOD:
+        hits = [np.flatnonzero(mask) for mask in evaluate_anomaly_detectors(stats, params)[0]]
+        index = np.concatenate(hits)
+        rule = np.concatenate([np.full(len(hit), code, dtype='int8') for code, hit in enumerate(hits)])
+        recent = timestamps[index] >= timestamps[-1] - SCREENER_LOOKBACK_DAYS * 86400
+        index, rule = index[recent], rule[recent]
+
+    # 当前区间：最后两个ZIG拐点之间的走势（最后一个拐点是尚未被确认反转的极值点）
+    source = params['zig_source']
+    values = stats['close'] if source == 'close' else stats['close_ma'][int(source[2:])]
+    pivot_indices, pivot_values = calculate_zig_pivots(values, params['zig_threshold'])
+    pivot_indices = pivot_indices[-2:] if len(pivot_indices) >= 2 else pivot_indices[:0]
+
+    # 事件、拐点和最后一根K线的日期一次格式化
+    dates = format_local_dates(timestamps[np.concatenate((index, pivot_indices, [bars - 1]))]).tolist()
+    events = {
+        'rule': rule,
+        'timestamp': timestamps[index],
+        'date': dates[:len(index)],
+        'pct': stats['price_change_pct'][index],
+        'close': stats['close'][index],
+        'volume': stats['volume'][index]
+    }
+    phase = None
+    if len(pivot_indices) == 2:
+        phase = {
+            'phase': 'Uptrend' if pivot_values[-1] > pivot_values[-2] else 'Downtrend',
+            'start_date': dates[len(index)],
+            'end_date': dates[len(index) + 1],
+            'change_pct': round(float(pivot_values[-1] / pivot_values[-2] - 1) * 100, 2),
+            'bars_since_pivot': int(bars - 1 - pivot_indices[-1])
+        }
+    return stamp, {
+        'bars': bars,
+        'last_date': dates[-1],
+        'last_close': round(float(stats['close'][-1]), 2),
+        'events': events,
+        'phase': phase
+    }
+
+def screen_ticker_chunk(yahoo_tickers, params):
+    """进程池任务：依次筛选一块股票，返回[(stamp, 结果)]"""
+    return [screen_ticker(yahoo_ticker, params) for yahoo_ticker in yahoo_tickers]
+
+def get_screener_pool():
+    """返回常驻的筛选进程池，首次调用时创建（子进程按需启动，最多SCREENER_WORKERS个）"""
+    with screener_lock:
+        if screener_state['pool'] is None:
+            screener_state['pool'] = ProcessPoolExecutor(max_workers=SCREENER_WORKERS,
+                                                         mp_context=multiprocessing.get_context('spawn'))
+        return screener_state['pool']
+
+def run_anomaly_screen(params, tickers=None, exchange=None, prefix=None):
+    """
+    对全市场（或按tickers/交易所后缀/代码前缀过滤后的子集）执行筛选，K线未变化的股票直接复用缓存结果
+    返回：(筛选范围[(ticker, yahoo_ticker, 公司名称)], {yahoo_ticker: 结果}, 本次统计)
+    """
+    start_time = time.time()
+    universe = load_screener_universe()
+    if tickers:
+        names = {t: name for t, _, name in universe}
+        universe = [(t, to_yahoo_format(t), names.get(t, '')) for t in tickers]
+    if exchange:
+        universe = [entry for entry in universe if entry[0].upper().endswith('.' + exchange.upper())]
+    if prefix:
+        universe = [entry for entry in universe if entry[0].startswith(prefix)]
+
+    cache_key = tuple(sorted(params.items()))
+    with screener_lock:
+        cached = screener_cache.get(cache_key)
+        if cached is None:
+            cached = screener_cache[cache_key] = {}
+        screener_cache.move_to_end(cache_key)
+        while len(screener_cache) > SCREENER_CACHE_KEYS:
+            screener_cache.popitem(last=False)
+        cached = dict(cached)
+
+    results = {}
+    stale = []
+    missing = 0
+    for _, yahoo_ticker, _ in universe:
+        stamp = price_file_stamp(yahoo_ticker)
+        entry = cached.get(yahoo_ticker)
+        if stamp is None:
+            missing += 1
+        elif entry is not None and entry[0] == stamp:
+            results[yahoo_ticker] = entry[1]
+        else:
+            stale.append(yahoo_ticker)
+    stale = list(dict.fromkeys(stale))
+
+    chunks = [stale[i:i + SCREENER_CHUNK_SIZE] for i in range(0, len(stale), SCREENER_CHUNK_SIZE)]
+    if len(chunks) == 1 or SCREENER_WORKERS <= 1:
+        screened = [screen_ticker_chunk(chunk, params) for chunk in chunks]
+    elif chunks:
+        pool = get_screener_pool()
+        try:
+            screened = list(pool.map(screen_ticker_chunk, chunks, [params] * len(chunks)))
+        except BrokenProcessPool:
+            # 子进程异常退出后进程池不可再用，丢弃后由下次筛选重新创建
+            with screener_lock:
+                if screener_state['pool'] is pool:
+                    screener_state['pool'] = None
+            raise
+    else:
+        screened = []
+
+    fresh = {}
+    for chunk, chunk_results in zip(chunks, screened):
+        for yahoo_ticker, (stamp, result) in zip(chunk, chunk_results):
+            if result is None:
+                missing += 1
+                continue
+            fresh[yahoo_ticker] = (stamp, result)
+            results[yahoo_ticker] = result
+    with screener_lock:
+        if cache_key in screener_cache:
+            screener_cache[cache_key].update(fresh)
+
+    run = {
+        'universe': len(universe),
+        'screened': len(results),
+        'recomputed': len(fresh),
+        'missing': missing,
+        'elapsed_ms': round((time.time() - start_time) * 1000, 2)
+    }
+    with screener_lock:
+        screener_state['last_run'] = run
+    print(f"[SCREENER] 筛选 {run['universe']} 只股票：重新计算 {run['recomputed']} 只，"
+          f"无K线缓存 {run['missing']} 只，耗时 {run['elapsed_ms']}ms")
+    return universe, results, run
+
+def rank_screen_events(universe, results, rules, days, phase=None, limit=100):
+    """
+    汇总筛选结果中最近days天内指定规则的事件，按日期倒序、同日按涨跌幅绝对值倒序排列
+    phase: 只保留当前区间为Uptrend/Downtrend的股票
+    """
+    cutoff = time.time() - days * 86400
+    codes = [ANOMALY_RULES.index(rule) for rule in rules]
+    ranked = []
+    for ticker, yahoo_ticker, name in universe:
+        result = results.get(yahoo_ticker)
+        if result is None or (phase and (result['phase'] is None or result['phase']['phase'] != phase)):
+            continue
+        events = result['events']
+        selected = np.flatnonzero(np.isin(events['rule'], codes) & (events['timestamp'] >= cutoff))
+        for i in selected.tolist():
+            ranked.append({
+                'ticker': ticker,
+                'company_name': name,
+                'rule': ANOMALY_RULES[events['rule'][i]],
+                'date': events['date'][i],
+                'timestamp': int(events['timestamp'][i]),
+                'price_change_pct': round(float(events['pct'][i]) * 100, 2),
+                'close': round(float(events['close'][i]), 2),
+                'volume': int(events['volume'][i]),
+                'phase': result['phase']
+            })
+    ranked.sort(key=lambda event: (-event['timestamp'], -abs(event['price_change_pct'])))
+    return ranked[:limit]
+
+def parse_screen_params(args):
+    """解析筛选参数（倍数默认值与图表接口一致）"""
+    params = {name: float(args.get(name, default)) for name, default in ANOMALY_GRID_DEFAULTS.items()}
+    params['zig_source'] = args.get('zig_source', 'ma50')
+    if params['zig_source'] not in SCREENER_ZIG_SOURCES:
+        raise ValueError(f'zig_source必须是 {SCREENER_ZIG_SOURCES} 之一')
+    params['zig_threshold'] = float(args.get('zig_threshold', 25))
+    return params
+
+@app.route('/api/anomaly/screen')
+@require_api_auth
+def anomaly_screen():
+    """
+    全市场异常筛选：返回最近days天内触发指定规则的股票事件排行（附当前区间）
+    参数：rule(规则名，逗号分隔，默认全部), days(默认5), limit(默认100), phase(Uptrend/Downtrend),
+    exchange(SH/SZ/BJ), prefix(代码前缀，如300), tickers(逗号分隔，指定后只筛选这些股票),
+    price_std/volume_std/price_only_std/volume_only_std, zig_source(close/ma5/ma25/ma50), zig_threshold
+    """
+    try:
+        params = parse_screen_params(request.args)
+        rules = [r.strip() for r in request.args.get('rule', ','.join(ANOMALY_RULES)).split(',') if r.strip()]
+        unknown = [r for r in rules if r not in ANOMALY_RULES]
+        if unknown:
+            raise ValueError(f'未知规则 {unknown}，可选 {ANOMALY_RULES}')
+        days = min(int(request.args.get('days', 5)), SCREENER_LOOKBACK_DAYS)
+        limit = int(request.args.get('limit', 100))
+        phase = request.args.get('phase')
+        if phase and phase not in ('Uptrend', 'Downtrend'):
+            raise ValueError('phase必须是 Uptrend 或 Downtrend')
+    except ValueError as e:
+        return jsonify({'error': f'筛选参数错误: {e}'}), 400
+
+    tickers = None
+    if request.args.get('tickers'):
+        tickers = []
+        for t in request.args.get('tickers').split(','):
+            normalized_ticker, _ = normalize_ticker(t.strip())
+            if normalized_ticker:
+                tickers.append(normalized_ticker)
+
+    try:
+        universe, results, run = run_anomaly_screen(params, tickers=tickers, exchange=request.args.get('exchange'),
+                                                    prefix=request.args.get('prefix'))
+        events = rank_screen_events(universe, results, rules, days, phase, limit)
+        return jsonify({
+            'success': True,
+            'rules': rules,
+            'days': days,
+            'params': params,
+            'run': run,
+            'count': len(events),
+            'events': events
+        })
+    except Exception as e:
+        print(f"[ERROR] 全市场异常筛选失败: {str(e)}")
+        return jsonify({'error': f'全市场异常筛选失败: {str(e)}'}), 500
+
 @app.route('/api/stock-list/update', methods=['POST'])
 @require_api_auth
 def update_stock_list():
@@ -3690,6 +5714,129 @@ def get_stock_list_stats():
             'error': str(e)
         }), 500
 
+# --- V6.2: 出站连接池状态API ---
+@app.route('/api/system/http-pool-stats', methods=['GET'])
+@require_api_auth
+def get_http_pool_stats_api():
+    """查看各外部域名连接池的连接新建/复用统计"""
+    return jsonify({
+        'success': True,
+        'pool_connections': HTTP_POOL_CONNECTIONS,
+        'pool_maxsize': HTTP_POOL_MAXSIZE,
+        'hosts': get_http_pool_stats()
+    })
+
+# --- V6.4: Yahoo限流器状态API ---
+@app.route('/api/system/yahoo-rate-limit', methods=['GET'])
+@require_api_auth
+def get_yahoo_rate_limit_api():
+    """查看Yahoo出站令牌桶、退避截止时间和排队的调用方数量"""
+    return jsonify({
+        'success': True,
+        'rate_limit': get_yahoo_rate_limit_state()
+    })
+
+# --- V7.7: 指标缓存状态API ---
+@app.route('/api/system/indicator-cache', methods=['GET'])
+@require_api_auth
+def get_indicator_cache_api():
+    """查看指标结果缓存的条目数、内存占用和命中率"""
+    return jsonify({
+        'success': True,
+        'indicator_cache': get_indicator_cache_stats()
+    })
+
+@app.route('/api/system/anomaly-detectors', methods=['GET'])
+@require_api_auth
+def get_anomaly_detectors_api():
+    """查看已注册的异常检测器（优先级、条件、参数）及各自的耗时统计"""
+    return jsonify({
+        'success': True,
+        'detectors': get_anomaly_detector_stats()
+    })
+
+
+# --- V7.1: 按日期定位K线 ---
+def locate_trading_day(timestamps, date):
+    """二分查找日期（YYYY-MM-DD，按UTC日期）对应的K线下标，该日无K线时返回None；日期格式错误抛出ValueError"""
+    day_start = int(datetime.datetime.strptime(date, '%Y-%m-%d').replace(tzinfo=datetime.timezone.utc).timestamp())
+    index = int(np.searchsorted(timestamps, day_start, side='left'))
+    if index < len(timestamps) and timestamps[index] < day_start + 86400:
+        return index
+    return None
+
+def build_date_price_data(series, index, normalized_ticker, company_name, date):
+    """根据K线下标生成单日股价波动数据（涨跌幅相对前一根K线的收盘价）"""
+    open_price = float(series['open'][index])
+    high = float(series['high'][index])
+    low = float(series['low'][index])
+    close = float(series['close'][index])
+    volume = int(series['volume'][index])
+
+    # 计算涨跌幅（需要前一交易日数据）
+    if index > 0:
+        prev_close = float(series['close'][index - 1])
+        change_pct = ((close - prev_close) / prev_close) * 100
+    else:
+        change_pct = 0
+
+    # 计算当日振幅
+    amplitude = ((high - low) / low) * 100
+
+    # 格式化数据为AI友好的文本
+    volatility_text = f"""股价波动情况：
+开盘价：{open_price:.2f}
+最高价：{high:.2f}
+最低价：{low:.2f}
+收盘价：{close:.2f}
+成交量：{volume:,}
+涨跌幅：{change_pct:+.2f}%
+当日振幅：{amplitude:.2f}%"""
+
+    # 格式化用户注释文本 - 为新建注释提供规范化内容
+    formatted_annotation_text = f"""{company_name} {normalized_ticker} 股价异动时点：{date}
+股价波动{change_pct:+.2f}%"""
+
+    return {
+        'date': date,
+        'volatility_text': volatility_text,
+        'formatted_annotation_text': formatted_annotation_text,
+        'data': {
+            'open': open_price,
+            'high': high,
+            'low': low,
+            'close': close,
+            'volume': volume,
+            'change_pct': round(change_pct, 2),
+            'amplitude': round(amplitude, 2)
+        }
+    }
+
+def load_date_lookup_series(ticker):
+    """
+    单日股价接口共用：标准化代码并读取缓存的日线序列
+    返回：(标准化代码, 行情序列, 错误响应)，成功时错误响应为None
+    """
+    normalized_ticker, identification_type = normalize_ticker(ticker)
+    if not normalized_ticker:
+        smart_error_msg = generate_smart_error_message(ticker, identification_type)
+        return None, None, (jsonify({'error': smart_error_msg}), 400)
+
+    # 为Yahoo API准备正确格式
+    yahoo_ticker = to_yahoo_format(normalized_ticker)
+    print(f"[API] 使用Yahoo格式: {yahoo_ticker}")
+
+    # V6.0: 从K线缓存读取日线历史（与主图共用缓存）
+    series, error_type, error_detail = get_price_series(yahoo_ticker, '1d')
+    if error_type == 'not_found':
+        return None, None, (jsonify({'error': f"无法获取 {ticker} 的股价数据"}), 404)
+    if error_type in ('invalid_response', 'rate_limited'):
+        return None, None, (jsonify({'error': 'Yahoo Finance请求频率受限，请稍后重试'}), 503)
+    if series is None:
+        return None, None, (jsonify({'error': f"股价数据格式不完整"}), 500)
+    if len(series['timestamp']) == 0:
+        return None, None, (jsonify({'error': f"没有有效的股价数据"}), 404)
+    return normalized_ticker, series, None
 
 # --- V4.8.1: 新增特定日期股价波动获取API，用于手动注释AI分析 ---
 @app.route('/api/stock_data/<string:ticker>/<string:date>')
@@ -3699,106 +5846,73 @@ def get_stock_data_for_date(ticker, date):
     print(f"[API] 获取股价波动数据: {ticker} on {date}")
     
     try:
-        # 标准化股票代码
-        normalized_ticker, identification_type = normalize_ticker(ticker)
-        if not normalized_ticker:
-            smart_error_msg = generate_smart_error_message(ticker, identification_type)
-            return jsonify({'error': smart_error_msg}), 400
-        
-        # 为Yahoo API准备正确格式
-        yahoo_ticker = to_yahoo_format(normalized_ticker)
-        print(f"[API] 使用Yahoo格式: {yahoo_ticker}")
-        
-        # 获取最近30天的数据以确保包含目标日期
-        url = f"https://query1.finance.yahoo.com/v8/finance/chart/{yahoo_ticker}?range=1mo&interval=1d"
-        response = requests.get(url, headers=HEADERS)
-        response.raise_for_status()
-        
-        yahoo_data = response.json()
-        result = yahoo_data.get('chart', {}).get('result', [])
-        if not result:
-            return jsonify({'error': f"无法获取 {ticker} 的股价数据"}), 404
-        
-        res = result[0]
-        timestamps = res.get('timestamp', [])
-        ohlc = res.get('indicators', {}).get('quote', [{}])[0]
-        
-        if not timestamps or not ohlc.get('open'):
-            return jsonify({'error': f"股价数据格式不完整"}), 500
-        
-        # 转换为DataFrame
-        df = pd.DataFrame({
-            'timestamp': timestamps,
-            'open': ohlc['open'],
-            'high': ohlc['high'],
-            'low': ohlc['low'],
-            'close': ohlc['close'],
-            'volume': ohlc.get('volume', [0] * len(timestamps))
-        })
-        
-        # 过滤无效数据
-        df = df.dropna()
-        if df.empty:
-            return jsonify({'error': f"没有有效的股价数据"}), 404
-        
-        # 转换时间戳为日期
-        df['date'] = pd.to_datetime(df['timestamp'], unit='s').dt.strftime('%Y-%m-%d')
-        
-        # 查找目标日期的数据
-        target_data = df[df['date'] == date]
-        if target_data.empty:
+        normalized_ticker, series, error_response = load_date_lookup_series(ticker)
+        if error_response:
+            return error_response
+
+        # V7.1: 在缓存的完整日线历史中二分查找目标日期
+        try:
+            index = locate_trading_day(series['timestamp'], date)
+        except ValueError:
+            index = None
+        if index is None:
             return jsonify({'error': f"未找到 {date} 的股价数据"}), 404
-        
-        row = target_data.iloc[0]
-        
-        # 计算涨跌幅（需要前一交易日数据）
-        prev_data = df[df['date'] < date].tail(1)
-        if not prev_data.empty:
-            prev_close = prev_data.iloc[0]['close']
-            change_pct = ((row['close'] - prev_close) / prev_close) * 100
-        else:
-            change_pct = 0
-        
-        # 计算当日振幅
-        amplitude = ((row['high'] - row['low']) / row['low']) * 100
-        
+
         # 获取公司名称
         company_name = get_company_name(normalized_ticker)
+
+        result = build_date_price_data(series, index, normalized_ticker, company_name, date)
+        return jsonify(dict(result, success=True, ticker=normalized_ticker, company_name=company_name))
         
-        # 格式化数据为AI友好的文本
-        volatility_text = f"""股价波动情况：
-开盘价：{row['open']:.2f}
-最高价：{row['high']:.2f}
-最低价：{row['low']:.2f}
-收盘价：{row['close']:.2f}
-成交量：{int(row['volume']):,}
-涨跌幅：{change_pct:+.2f}%
-当日振幅：{amplitude:.2f}%"""
-        
-        # 格式化用户注释文本 - 为新建注释提供规范化内容
-        formatted_annotation_text = f"""{company_name} {normalized_ticker} 股价异动时点：{date}
-股价波动{change_pct:+.2f}%"""
-        
+    except Exception as e:
+        print(f"[ERROR] 获取股价波动数据失败: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'获取股价数据失败: {str(e)}'
+        }), 500
+
+# --- V7.1: 多日期股价波动批量获取API ---
+@app.route('/api/stock_data/<string:ticker>/dates', methods=['POST'])
+@require_api_auth
+def get_stock_data_for_dates(ticker):
+    """
+    一次获取同一股票多个日期的股价波动数据（批量AI分析使用）
+    请求体：{"dates": ["2024-01-02", ...]}，只读取一次缓存的日线序列，各日期二分查找
+    results以日期为键，找不到的日期单独返回错误
+    """
+    data = request.get_json(silent=True) or {}
+    dates = data.get('dates')
+    if not isinstance(dates, list) or not dates:
+        return jsonify({'error': 'dates必须是非空列表'}), 400
+    print(f"[API] 批量获取股价波动数据: {ticker}，{len(dates)} 个日期")
+
+    try:
+        normalized_ticker, series, error_response = load_date_lookup_series(ticker)
+        if error_response:
+            return error_response
+
+        company_name = get_company_name(normalized_ticker)
+        results = {}
+        for date in dict.fromkeys(str(d) for d in dates):
+            try:
+                index = locate_trading_day(series['timestamp'], date)
+            except ValueError:
+                results[date] = {'success': False, 'error': f"日期格式错误: {date}，应为YYYY-MM-DD"}
+                continue
+            if index is None:
+                results[date] = {'success': False, 'error': f"未找到 {date} 的股价数据"}
+                continue
+            results[date] = dict(build_date_price_data(series, index, normalized_ticker, company_name, date), success=True)
+
         return jsonify({
             'success': True,
             'ticker': normalized_ticker,
             'company_name': company_name,
-            'date': date,
-            'volatility_text': volatility_text,
-            'formatted_annotation_text': formatted_annotation_text,
-            'data': {
-                'open': float(row['open']),
-                'high': float(row['high']),
-                'low': float(row['low']),
-                'close': float(row['close']),
-                'volume': int(row['volume']),
-                'change_pct': round(change_pct, 2),
-                'amplitude': round(amplitude, 2)
-            }
+            'results': results
         })
-        
+
     except Exception as e:
-        print(f"[ERROR] 获取股价波动数据失败: {str(e)}")
+        print(f"[ERROR] 批量获取股价波动数据失败: {str(e)}")
         return jsonify({
             'success': False,
             'error': f'获取股价数据失败: {str(e)}'
@@ -4068,5 +6182,8 @@ def migration_status():
         print(f"[ERROR] 状态检查失败: {str(e)}")
         return jsonify({'error': f'状态检查失败: {str(e)}'}), 500
 
+# V6.9: 启动收盘后预取调度（需设置PREFETCH_ENABLED=true）
+start_prefetch_scheduler()
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5001)
@@ -0,0 +1,169 @@
+"""
+MarketNarrative ZIG指标等价性校验与性能基准
+
+功能：
+1. 用随机序列（含前导NaN、中间NaN、重复价格、零值）对比向量化ZIG引擎与原逐点循环实现的拐点是否完全一致
+2. 在与stock_data相同的场景（约5000根K线，3条价格均线 + 3条成交量均线）下对比两者耗时
+
+使用方法：
+    python scripts/benchmark_zig.py
+    python scripts/benchmark_zig.py --cases 2000 --bars 5000 --repeat 5
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import calculate_zig
+
+
+def legacy_calculate_zig(series, threshold):
+    """V7.2之前的逐点循环实现，作为等价性校验的参照"""
+    if series.isnull().all():
+        return [None] * len(series)
+
+    # 找到第一个有效值作为起点
+    first_valid_index = series.first_valid_index()
+    if first_valid_index is None:
+        return [None] * len(series)
+
+    threshold = threshold / 100.0
+    trend = 0  # 0: TBD, 1: up, -1: down
+    last_pivot_price = series[first_valid_index]
+    last_pivot_index = first_valid_index
+    pivots = {last_pivot_index: last_pivot_price}
+
+    for i in range(first_valid_index + 1, len(series)):
+        current_price = series.iloc[i]
+        if pd.isna(current_price):
+            continue
+
+        if trend == 0:
+            if current_price / last_pivot_price > 1 + threshold:
+                trend = 1
+                pivots[i] = current_price
+                last_pivot_price = current_price
+                last_pivot_index = i
+            elif current_price / last_pivot_price < 1 - threshold:
+                trend = -1
+                pivots[i] = current_price
+                last_pivot_price = current_price
+                last_pivot_index = i
+        elif trend == 1:
+            if current_price > last_pivot_price:
+                pivots.pop(last_pivot_index)
+                pivots[i] = current_price
+                last_pivot_price = current_price
+                last_pivot_index = i
+            elif current_price / last_pivot_price < 1 - threshold:
+                trend = -1
+                pivots[i] = current_price
+                last_pivot_price = current_price
+                last_pivot_index = i
+        elif trend == -1:
+            if current_price < last_pivot_price:
+                pivots.pop(last_pivot_index)
+                pivots[i] = current_price
+                last_pivot_price = current_price
+                last_pivot_index = i
+            elif current_price / last_pivot_price > 1 + threshold:
+                trend = 1
+                pivots[i] = current_price
+                last_pivot_price = current_price
+                last_pivot_index = i
+
+    zig_series = pd.Series([np.nan] * len(series), index=series.index)
+    for index, value in pivots.items():
+        zig_series.loc[index] = value
+
+    return [None if pd.isna(x) else x for x in zig_series]
+
+
+def random_series(rng, bars):
+    """生成一条随机测试序列：随机游走价格，按概率加入前导NaN、零散NaN、重复价格和零值"""
+    kind = rng.integers(0, 4)
+    if kind == 0:
+        values = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, bars)))
+    elif kind == 1:
+        # 整数价格，制造大量相同价格
+        values = np.maximum(1, np.round(20 + np.cumsum(rng.integers(-1, 2, bars)))).astype(float)
+    elif kind == 2:
+        # 成交量类序列，含零值
+        values = rng.lognormal(10, 1, bars)
+        values[rng.random(bars) < 0.05] = 0.0
+    else:
+        values = pd.Series(50 * np.exp(np.cumsum(rng.normal(0, 0.03, bars)))).rolling(int(rng.integers(2, 60))).mean().to_numpy(copy=True)
+
+    lead = int(rng.integers(0, min(bars, 80)))
+    values[:lead] = np.nan
+    if rng.random() < 0.3:
+        values[rng.random(bars) < 0.02] = np.nan
+    return pd.Series(values)
+
+
+def check_equivalence(cases, bars, seed):
+    rng = np.random.default_rng(seed)
+    thresholds = [0.5, 1, 2.5, 5, 7, 10, 25, 50, 99]
+    for case in range(cases):
+        series = random_series(rng, int(rng.integers(1, bars)))
+        threshold = float(rng.choice(thresholds))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            expected = legacy_calculate_zig(series, threshold)
+        actual = calculate_zig(series, threshold)
+        if expected != actual:
+            diff = next(i for i, (a, b) in enumerate(zip(expected, actual)) if a != b)
+            print(f"❌ 第 {case} 组不一致：长度 {len(series)}，阈值 {threshold}%，首个差异下标 {diff}")
+            return False
+    print(f"✅ {cases} 组随机序列的拐点完全一致")
+    return True
+
+
+def benchmark(bars, repeat, seed):
+    rng = np.random.default_rng(seed)
+    close = pd.Series(50 * np.exp(np.cumsum(rng.normal(0, 0.02, bars))))
+    volume = pd.Series(rng.lognormal(14, 0.5, bars))
+    # 与stock_data相同：3条价格均线 + 3条成交量均线
+    workload = [
+        (close.rolling(5).mean(), 10), (close.rolling(25).mean(), 10), (close.rolling(50).mean(), 25),
+        (volume.rolling(5).mean(), 10), (volume.rolling(25).mean(), 10), (volume.rolling(50).mean(), 10),
+    ]
+
+    def timed(fn):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for series, threshold in workload:
+                fn(series, threshold)
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    legacy = timed(legacy_calculate_zig)
+    vectorized = timed(calculate_zig)
+    print(f"\n基准：{bars} 根K线 × 6 条均线（取 {repeat} 次中的最快一次）")
+    print(f"  原逐点循环:  {legacy * 1000:8.2f} ms")
+    print(f"  向量化引擎:  {vectorized * 1000:8.2f} ms")
+    print(f"  加速比:      {legacy / vectorized:8.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ZIG指标等价性校验与性能基准')
+    parser.add_argument('--cases', type=int, default=1000, help='随机校验的序列数量')
+    parser.add_argument('--bars', type=int, default=5000, help='序列长度')
+    parser.add_argument('--repeat', type=int, default=5, help='基准重复次数')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    if not check_equivalence(args.cases, args.bars, args.seed):
+        return 1
+    benchmark(args.bars, args.repeat, args.seed)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
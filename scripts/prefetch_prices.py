@@ -0,0 +1,55 @@
+"""
+MarketNarrative 收盘后行情预取脚本
+
+功能：
+1. 刷新关注列表（PREFETCH_WATCHLIST）和访问最多的股票的K线缓存
+2. 按默认阈值续算日线ZIG，写入 <ticker>.zig.json（不写算法注释）
+3. 输出每只股票各步骤的耗时报告
+
+与应用内的定时预取（PREFETCH_ENABLED=true）逻辑相同，适合由cron等外部调度调用
+
+使用方法：
+    python scripts/prefetch_prices.py                  # 全部市场
+    python scripts/prefetch_prices.py --market CN      # 只预取A股
+    python scripts/prefetch_prices.py --tickers AAPL,600519,0700.HK
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as market_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='收盘后预取行情缓存')
+    parser.add_argument('--market', choices=sorted(market_app.MARKET_CLOSE_TIMES), help='只预取指定市场')
+    parser.add_argument('--tickers', help='逗号分隔的股票代码，指定后不使用关注列表和访问统计')
+    parser.add_argument('--json', action='store_true', help='以JSON格式输出完整报告')
+    args = parser.parse_args()
+
+    tickers = [t.strip() for t in args.tickers.split(',') if t.strip()] if args.tickers else None
+    report = market_app.run_prefetch(market=args.market, tickers=tickers)
+    if report is None:
+        print("[预取] 已有预取任务在运行")
+        return 1
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print(f"\n[预取] {report['market']}: {report['succeeded']}/{report['count']} 成功，"
+              f"K线 {report['elapsed']['bars']}s，指标 {report['elapsed']['indicators']}s，"
+              f"总计 {report['elapsed']['total']}s")
+        for item in report['results']:
+            status = '✅' if item['success'] else f"❌ {item.get('error')}"
+            steps = ', '.join(f"{name} {seconds}s" for name, seconds in item['steps'].items())
+            print(f"  {item['ticker']:<12} {item['market']:<3} {status}  ({steps})")
+
+    return 0 if report['succeeded'] == report['count'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
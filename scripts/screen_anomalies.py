@@ -0,0 +1,77 @@
+"""
+MarketNarrative 全市场异常筛选脚本
+
+功能：
+1. 在本地K线缓存上对A股全市场名单（或按交易所/代码前缀/指定股票过滤后的子集）运行异常规则
+2. 按日期倒序列出最近N天触发指定规则的股票，并附带当前区间（上涨/下跌）
+3. 输出筛选范围、重新计算数量、缺少K线缓存的数量和耗时
+
+与 /api/anomaly/screen 逻辑相同，适合在收盘预取之后由cron等外部调度调用
+
+使用方法：
+    python scripts/screen_anomalies.py                              # 全市场最近5天的全部异常
+    python scripts/screen_anomalies.py --rule price_volume --days 3
+    python scripts/screen_anomalies.py --exchange SZ --prefix 300 --phase Uptrend
+    python scripts/screen_anomalies.py --price-std 2.0 --zig-source ma25 --zig-threshold 15
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as market_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='全市场异常筛选')
+    parser.add_argument('--rule', help=f"规则名，逗号分隔（默认全部：{','.join(market_app.ANOMALY_RULES)}）")
+    parser.add_argument('--days', type=int, default=5, help='只列出最近N天的事件')
+    parser.add_argument('--limit', type=int, default=100, help='最多列出的事件数')
+    parser.add_argument('--phase', choices=['Uptrend', 'Downtrend'], help='只保留当前处于该区间的股票')
+    parser.add_argument('--exchange', help='交易所后缀：SH / SZ / BJ')
+    parser.add_argument('--prefix', help='代码前缀，如 300、688')
+    parser.add_argument('--tickers', help='逗号分隔的股票代码，指定后只筛选这些股票')
+    parser.add_argument('--json', action='store_true', help='以JSON格式输出完整结果')
+    # 筛选参数与接口同名，缺省时使用与图表接口一致的默认值
+    for name, default in market_app.ANOMALY_GRID_DEFAULTS.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", dest=name, type=float, help=f'异常规则倍数（默认{default}）')
+    parser.add_argument('--zig-source', dest='zig_source', choices=market_app.SCREENER_ZIG_SOURCES,
+                        help='判断当前区间的ZIG数据源（默认ma50）')
+    parser.add_argument('--zig-threshold', dest='zig_threshold', type=float, help='判断当前区间的ZIG阈值（默认25）')
+    args = parser.parse_args()
+
+    names = list(market_app.ANOMALY_GRID_DEFAULTS) + ['zig_source', 'zig_threshold']
+    params = market_app.parse_screen_params({name: getattr(args, name) for name in names
+                                             if getattr(args, name) is not None})
+    rules = args.rule.split(',') if args.rule else market_app.ANOMALY_RULES
+    unknown = [r for r in rules if r not in market_app.ANOMALY_RULES]
+    if unknown:
+        print(f"[筛选] 未知规则 {unknown}，可选 {market_app.ANOMALY_RULES}")
+        return 1
+    tickers = None
+    if args.tickers:
+        # 与接口一致：先统一成内部代码格式（600519 -> 600519.SH），再与全市场名单匹配
+        tickers = [t for t in (market_app.normalize_ticker(t.strip())[0] for t in args.tickers.split(',')) if t]
+
+    universe, results, run = market_app.run_anomaly_screen(params, tickers=tickers, exchange=args.exchange,
+                                                           prefix=args.prefix)
+    events = market_app.rank_screen_events(universe, results, rules, min(args.days, market_app.SCREENER_LOOKBACK_DAYS),
+                                           args.phase, args.limit)
+
+    if args.json:
+        print(json.dumps({'run': run, 'events': events}, ensure_ascii=False, indent=2))
+    else:
+        print(f"\n[筛选] {run['universe']} 只股票，已筛选 {run['screened']}，重新计算 {run['recomputed']}，"
+              f"无K线缓存 {run['missing']}，耗时 {run['elapsed_ms']}ms")
+        for event in events:
+            phase = event['phase']['phase'] if event['phase'] else '-'
+            print(f"  {event['date']}  {event['ticker']:<10} {event['company_name']:<8} {event['rule']:<20} "
+                  f"{event['price_change_pct']:>7.2f}%  {phase}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())